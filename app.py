@@ -1,13 +1,67 @@
-from flask import Flask, render_template, request, jsonify, send_file
-from database import Database, WRVU_LOOKUP, calculate_wrvu
-from datetime import datetime, date, timedelta
-import pandas as pd
-from io import BytesIO
-from collections import defaultdict
+from flask import Flask, Response, render_template, request, jsonify, send_file, make_response, g, has_app_context
+from werkzeug.http import is_resource_modified
+from werkzeug.local import LocalProxy
+from database import Database, DatabaseRouter
+from datetime import datetime, date, timedelta, timezone
+import base64
+import click
+import functools
+import gzip
+import hashlib
+import itertools
 import json
+import os
+import sqlite3
+import tempfile
+import unicodedata
+from urllib.parse import quote
+import metrics
+import qi_stats
+
+# exporter (openpyxl) and importer (pandas) are imported inside the routes
+# that use them, so workers that never export or import don't load them
 
 app = Flask(__name__)
-db = Database()
+# Request latency, sizes and SQL counts are measured until the last byte
+# of the response is sent, so streamed exports are timed in full
+app.wsgi_app = metrics.RequestMetrics(app.wsgi_app)
+
+# Statements slower than this many milliseconds are logged with their query
+# plan and listed at /api/admin/slow-queries; set it empty to turn that off
+SLOW_QUERY_MS = os.environ.get('CLINIC_TRACKER_SLOW_QUERY_MS', '200')
+
+DATABASE_OPTIONS = {
+    'pool_size': int(os.environ.get('CLINIC_TRACKER_DB_POOL_SIZE', 8)),
+    'write_queue': os.environ.get('CLINIC_TRACKER_WRITE_QUEUE') == '1',
+    'query_listeners': [metrics.record_query],
+    'slow_query_ms': float(SLOW_QUERY_MS) if SLOW_QUERY_MS else None
+}
+default_db = Database(os.environ.get('CLINIC_TRACKER_DB', 'clinic_tracker.db'), **DATABASE_OPTIONS)
+
+# With a shard directory, each provider's visits and projects live in
+# <dir>/<provider>.db; requests without a provider use the default database
+SHARD_DIR = os.environ.get('CLINIC_TRACKER_SHARD_DIR')
+router = DatabaseRouter(default_db, SHARD_DIR, **DATABASE_OPTIONS) if SHARD_DIR else None
+
+# Where a request names its provider, in order of precedence
+PROVIDER_HEADER = 'X-Provider'
+PROVIDER_ARG = 'provider'
+PROVIDER_COOKIE = 'provider'
+
+def get_db():
+    """The database for the current request's provider shard.
+
+    Work that outlives the request (import jobs, streamed exports) must be
+    handed get_db() itself rather than the db proxy.
+    """
+    if has_app_context():
+        return g.get('db', default_db)
+    return default_db
+
+db = LocalProxy(get_db)
+
+# JSON responses at least this large are gzipped for clients that accept it
+GZIP_MIN_SIZE = 1024
 
 # Helper functions
 def get_today():
@@ -21,86 +75,126 @@ def format_duration(seconds):
     secs = seconds % 60
     return f"{mins:02d}:{secs:02d}"
 
-def calculate_statistics(visits):
-    """Calculate summary statistics for a list of visits"""
-    if not visits:
-        return {
-            'total_visits': 0,
-            'avg_duration': 0,
-            'total_duration': 0,
-            'billing_codes': {},
-            'visit_types': {},
-            'custom_field_stats': {},
-            'total_wrvu': 0,
-            'avg_wrvu': 0,
-            'days_of_week': {}
-        }
-
-    total_duration = sum(v['active_duration'] for v in visits)
-    avg_duration = total_duration / len(visits) if visits else 0
-
-    # Count billing codes and calculate wRVUs
-    billing_codes = defaultdict(int)
-    total_wrvu = 0.0
-    for v in visits:
-        if v['billing_code']:
-            # Handle multiple billing codes
-            try:
-                codes = json.loads(v['billing_code']) if v['billing_code'].startswith('[') else [v['billing_code']]
-            except:
-                codes = [v['billing_code']]
-
-            for code in codes:
-                code = code.strip()
-                if code:
-                    billing_codes[code] += 1
-
-            # Calculate wRVU for this visit
-            total_wrvu += calculate_wrvu(v['billing_code'])
-
-    avg_wrvu = total_wrvu / len(visits) if visits else 0
-
-    # Count visit types
-    visit_types = defaultdict(int)
-    for v in visits:
-        if v['visit_type']:
-            visit_types[v['visit_type']] += 1
-
-    # Count days of week
-    days_of_week = defaultdict(int)
-    for v in visits:
-        if v.get('day_of_week'):
-            days_of_week[v['day_of_week']] += 1
-
-    # Calculate average duration by visit type
-    duration_by_type = defaultdict(list)
-    for v in visits:
-        if v['visit_type']:
-            duration_by_type[v['visit_type']].append(v['active_duration'])
-
-    avg_by_type = {}
-    for vtype, durations in duration_by_type.items():
-        avg_by_type[vtype] = sum(durations) / len(durations)
-
-    # Custom field statistics
-    custom_field_stats = defaultdict(lambda: defaultdict(int))
-    for v in visits:
-        if v.get('custom_fields'):
-            for field_name, field_value in v['custom_fields'].items():
-                custom_field_stats[field_name][str(field_value)] += 1
-
-    return {
-        'total_visits': len(visits),
-        'avg_duration': avg_duration,
-        'total_duration': total_duration,
-        'billing_codes': dict(billing_codes),
-        'visit_types': dict(visit_types),
-        'avg_by_type': avg_by_type,
-        'custom_field_stats': dict(custom_field_stats),
-        'total_wrvu': total_wrvu,
-        'avg_wrvu': avg_wrvu,
-        'days_of_week': dict(days_of_week)
-    }
+def encode_cursor(key):
+    """Encode a keyset pagination key as an opaque URL-safe token"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(token, length):
+    """Decode a cursor token into a key tuple of `length` values.
+
+    Raises ValueError if it is malformed or isn't a key of that shape.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (TypeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+    if (not isinstance(key, list) or len(key) != length
+            or not all(value is None or isinstance(value, (str, int, float)) for value in key)):
+        raise ValueError('Invalid cursor')
+    return tuple(key)
+
+def set_attachment(response, filename):
+    """Mark a streamed response as a download, as send_file does for files"""
+    try:
+        filename.encode('ascii')
+        response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    except UnicodeEncodeError:
+        # ASCII fallback plus the RFC 2231 UTF-8 name for clients that support it
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        response.headers.set('Content-Disposition', 'attachment', filename=simple,
+                             **{'filename*': f"UTF-8''{quote(filename, safe='')}"})
+    return response
+
+def conditional(*version_names):
+    """Serve a GET view with validators derived from data versions.
+
+    The ETag covers the named data versions, the full request path, the
+    provider shard and the current date (relative periods such as 'today'
+    move with it), so a matching If-None-Match is answered with 304 before
+    the view runs any query. Last-Modified is the latest change to those
+    versions.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = db.get_data_versions(version_names)
+            key = json.dumps([sorted(versions.items()), request.full_path, get_today(),
+                              g.get('provider')])
+            etag = hashlib.sha1(key.encode()).hexdigest()
+
+            updated = [updated_at for _, updated_at in versions.values() if updated_at]
+            last_modified = (datetime.strptime(max(updated), '%Y-%m-%dT%H:%M:%SZ')
+                             .replace(tzinfo=timezone.utc) if updated else None)
+
+            if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = make_response(view(*args, **kwargs))
+            else:
+                response = Response(status=304)
+
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            if router is not None:
+                response.vary.update((PROVIDER_HEADER, 'Cookie'))
+            # Let browsers keep the response but revalidate it on every use
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+@app.before_request
+def label_route():
+    """Record the matched route rule (not the raw URL) for request metrics"""
+    if request.url_rule is not None:
+        request.environ[metrics.ROUTE_ENVIRON_KEY] = request.url_rule.rule
+
+@app.before_request
+def select_shard():
+    """Route the request to its provider's shard when sharding is enabled"""
+    if router is None:
+        return None
+
+    provider = (request.headers.get(PROVIDER_HEADER)
+                or request.args.get(PROVIDER_ARG)
+                or request.cookies.get(PROVIDER_COOKIE))
+    try:
+        g.db = router.shard(provider)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    g.provider = provider or None
+    return None
+
+@app.after_request
+def remember_provider(response):
+    """Keep a provider picked with ?provider= for the pages' own API calls"""
+    if router is None or PROVIDER_ARG not in request.args:
+        return response
+
+    provider = request.args[PROVIDER_ARG]
+    if provider and g.get('provider') == provider:
+        response.set_cookie(PROVIDER_COOKIE, provider, samesite='Lax', httponly=True)
+    elif not provider:
+        response.delete_cookie(PROVIDER_COOKIE)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Gzip large JSON responses when the client accepts it"""
+    if (response.mimetype != 'application/json'
+            or response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip'] or (response.content_length or 0) < GZIP_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 # Routes
 @app.route('/')
@@ -115,11 +209,43 @@ def import_data():
     return render_template('import.html')
 
 @app.route('/api/custom-fields')
+@conditional('config')
 def get_custom_fields():
     """Get all custom field configurations"""
     fields = db.get_custom_fields()
     return jsonify(fields)
 
+@app.route('/api/visits')
+def list_visits():
+    """Page through visits newest first, with optional filters"""
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor, 3) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Fetch one extra visit to learn whether another page follows
+    visits = list(itertools.islice(db.iter_visits(
+        start_date=request.args.get('start_date'),
+        end_date=request.args.get('end_date'),
+        visit_type=request.args.get('visit_type'),
+        billing_code=request.args.get('billing_code'),
+        after=after,
+        batch_size=limit + 1
+    ), limit + 1))
+
+    next_cursor = None
+    if len(visits) > limit:
+        visits = visits[:limit]
+        last = visits[-1]
+        next_cursor = encode_cursor([last['date'], last['start_time'], last['id']])
+
+    return jsonify({
+        'visits': visits,
+        'next_cursor': next_cursor
+    })
+
 @app.route('/api/visit', methods=['POST'])
 def create_visit():
     """Create a new visit"""
@@ -145,7 +271,7 @@ def daily_summary():
     """Daily summary page"""
     target_date = request.args.get('date', get_today())
     visits = db.get_visits_by_date(target_date)
-    stats = calculate_statistics(visits)
+    stats = db.get_range_statistics(target_date, target_date)
     custom_fields = db.get_custom_fields()
 
     return render_template('daily_summary.html',
@@ -156,25 +282,23 @@ def daily_summary():
                          format_duration=format_duration)
 
 @app.route('/api/daily-visits')
+@conditional('visits')
 def get_daily_visits():
     """Get visits for a specific date (API)"""
     target_date = request.args.get('date', get_today())
     visits = db.get_visits_by_date(target_date)
-    stats = calculate_statistics(visits)
+    stats = db.get_range_statistics(target_date, target_date)
 
     return jsonify({
         'visits': visits,
         'stats': stats
     })
 
-@app.route('/dashboard')
-def dashboard():
-    """Dashboard with historical data"""
-    return render_template('dashboard.html')
+def period_range(rollup_date_range):
+    """Start and end dates selected by the ?period= (or custom range) arguments.
 
-@app.route('/api/dashboard-data')
-def get_dashboard_data():
-    """Get dashboard data for specified date range"""
+    rollup_date_range is called for 'alltime' to find the span of stored data.
+    """
     period = request.args.get('period', 'today')
 
     today = date.today()
@@ -191,12 +315,10 @@ def get_dashboard_data():
         start_date = (today - timedelta(days=30)).isoformat()
         end_date = today.isoformat()
     elif period == 'alltime':
-        # Get all visits without date filtering
-        visits = db.get_visits()
-        # Determine actual date range from visits
-        if visits:
-            start_date = min(v['date'] for v in visits)
-            end_date = max(v['date'] for v in visits)
+        # Determine actual date range from the rollups
+        date_range = rollup_date_range()
+        if date_range:
+            start_date, end_date = date_range
         else:
             start_date = end_date = today.isoformat()
     elif period == 'custom':
@@ -205,20 +327,27 @@ def get_dashboard_data():
     else:
         start_date = end_date = today.isoformat()
 
-    # Get visits if not already retrieved (for alltime)
-    if period != 'alltime':
-        visits = db.get_visits(start_date, end_date)
-
-    stats = calculate_statistics(visits)
+    return start_date, end_date
 
-    # Group by date for trend analysis
-    visits_by_date = defaultdict(list)
-    for v in visits:
-        visits_by_date[v['date']].append(v)
+@app.route('/dashboard')
+def dashboard():
+    """Dashboard with historical data"""
+    return render_template('dashboard.html')
 
-    daily_stats = {}
-    for date_str, day_visits in visits_by_date.items():
-        daily_stats[date_str] = calculate_statistics(day_visits)
+@app.route('/api/dashboard-data')
+@conditional('visits')
+def get_dashboard_data():
+    """Get dashboard data for specified date range (?layout=columnar for compact daily_stats)"""
+    start_date, end_date = period_range(db.get_rollup_date_range)
+
+    # Summary and per-day trend statistics are aggregated in SQL from the
+    # daily rollups, so the cost scales with days in the range rather than visits
+    stats = db.get_range_statistics(start_date, end_date)
+    if request.args.get('layout') == 'columnar':
+        # Parallel per-day arrays instead of a full statistics dict per date
+        daily_stats = db.get_daily_rollup_columns(start_date, end_date)
+    else:
+        daily_stats = db.get_daily_rollup_statistics(start_date, end_date)
 
     return jsonify({
         'stats': stats,
@@ -227,6 +356,35 @@ def get_dashboard_data():
         'end_date': end_date
     })
 
+@app.route('/api/group/dashboard-data')
+def get_group_dashboard_data():
+    """Dashboard statistics combined across provider shards.
+
+    ?providers=a,b limits the group to those shards; by default it covers
+    the default database and every shard. Takes the same period arguments
+    as /api/dashboard-data.
+    """
+    if router is None:
+        return jsonify({'error': 'Provider sharding is not enabled'}), 404
+
+    providers = request.args.get('providers')
+    shards = [name for name in providers.split(',') if name] if providers else None
+    try:
+        start_date, end_date = period_range(lambda: router.get_rollup_date_range(shards))
+        stats = router.get_range_statistics(start_date, end_date, shards)
+        provider_totals = router.shard_totals(start_date, end_date, shards)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+
+    return jsonify({
+        'stats': stats,
+        'providers': provider_totals,
+        'start_date': start_date,
+        'end_date': end_date
+    })
+
 @app.route('/settings')
 def settings():
     """Settings page for managing custom fields"""
@@ -254,9 +412,63 @@ def delete_custom_field(field_id):
     return jsonify({'success': True})
 
 @app.route('/api/wrvu-lookup')
+@conditional('fee_schedule')
 def get_wrvu_lookup():
-    """Get wRVU lookup table"""
-    return jsonify(WRVU_LOOKUP)
+    """Get the wRVU of each billing code in force on ?date= (default today)"""
+    return jsonify(db.get_fee_schedule(request.args.get('date') or get_today()))
+
+@app.route('/api/fee-schedule', methods=['GET'])
+@conditional('fee_schedule')
+def get_fee_schedule():
+    """Get every dated version of the billing code wRVU values"""
+    return jsonify(db.get_fee_schedule_versions())
+
+def apply_fee_schedule_change(change):
+    """Run change(database) on the default database and every provider shard.
+
+    The fee schedule is clinic-wide, so each database gets the change in
+    its own transaction. Bad input fails on the first database before
+    anything is written. A database that fails (e.g. locked) doesn't stop
+    the others; the response lists each database's outcome, and resending
+    the same change is safe.
+    """
+    databases = [(None, default_db)]
+    if router is not None:
+        databases += [(name, router.shard(name)) for name in router.shard_names()]
+
+    results = []
+    for provider, database in databases:
+        try:
+            results.append({'provider': provider, 'visits_repriced': change(database)})
+        except sqlite3.Error as e:
+            results.append({'provider': provider, 'error': str(e)})
+
+    failed = [result['provider'] for result in results if 'error' in result]
+    return jsonify({
+        'success': not failed,
+        'visits_repriced': sum(result.get('visits_repriced', 0) for result in results),
+        'databases': results
+    }), 503 if failed else 200
+
+@app.route('/api/fee-schedule', methods=['POST'])
+def set_fee_schedule():
+    """Add wRVU values in force from a date and re-price the visits they affect.
+
+    Body: {"effective_date": "YYYY-MM-DD", "entries": [{"code", "wrvu",
+    "description"}]}.
+    """
+    data = request.json or {}
+    try:
+        return apply_fee_schedule_change(lambda database: database.set_fee_schedule(
+            data.get('effective_date') or '', data.get('entries') or []))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/fee-schedule/<code>/<effective_date>', methods=['DELETE'])
+def delete_fee_schedule_version(code, effective_date):
+    """Remove one dated version of a code, re-pricing the visits it covered"""
+    return apply_fee_schedule_change(
+        lambda database: database.delete_fee_schedule_version(code, effective_date))
 
 @app.route('/api/wrvu-conversion-rate', methods=['GET'])
 def get_wrvu_conversion_rate():
@@ -273,75 +485,37 @@ def set_wrvu_conversion_rate():
 
 @app.route('/api/export')
 def export_data():
-    """Export data to Excel"""
+    """Export data to Excel, or stream it as CSV/NDJSON (?format=csv|ndjson)"""
+    import exporter
+
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
+    export_format = request.args.get('format', 'xlsx')
 
-    visits = db.get_visits(start_date, end_date)
-
-    # Prepare data for Excel (using import-compatible column names)
-    export_data = []
-    for i, visit in enumerate(visits, 1):
-        row = {
-            'date': visit['date'],
-            'start_time': visit['start_time'],
-            'end_time': visit['end_time'],
-            'active_duration': visit['active_duration'],
-            'visit_type': visit['visit_type'],
-            'billing_code': visit['billing_code'],
-            'comments': visit['comments']
-        }
-
-        # Add custom fields
-        if visit.get('custom_fields'):
-            for field_name, field_value in visit['custom_fields'].items():
-                row[field_name] = field_value
-
-        export_data.append(row)
-
-    # Create Excel file
-    df = pd.DataFrame(export_data)
+    filename = f"clinic_visits_{start_date}_to_{end_date}.{export_format}"
 
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Visits', index=False)
+    if export_format == 'csv':
+        return set_attachment(Response(exporter.iter_csv(get_db(), start_date, end_date),
+                                       mimetype='text/csv'), filename)
 
-        # Add statistics sheet
-        visits_list = db.get_visits(start_date, end_date)
-        stats = calculate_statistics(visits_list)
+    if export_format == 'ndjson':
+        return set_attachment(Response(exporter.iter_ndjson(get_db(), start_date, end_date),
+                                       mimetype='application/x-ndjson'), filename)
 
-        stats_data = [
-            ['Metric', 'Value'],
-            ['Total Visits', stats['total_visits']],
-            ['Average Duration (min)', stats['avg_duration'] / 60],
-            ['Total Duration (min)', stats['total_duration'] / 60],
-            ['', ''],
-            ['Visit Types', 'Count']
-        ]
+    if export_format != 'xlsx':
+        return jsonify({'error': 'Unsupported format. Use xlsx, csv or ndjson'}), 400
 
-        for vtype, count in stats['visit_types'].items():
-            stats_data.append([vtype, count])
-
-        stats_data.append(['', ''])
-        stats_data.append(['Billing Codes', 'Count'])
-
-        for code, count in stats['billing_codes'].items():
-            stats_data.append([code, count])
-
-        stats_df = pd.DataFrame(stats_data)
-        stats_df.to_excel(writer, sheet_name='Statistics', index=False, header=False)
-
-    output.seek(0)
-
-    filename = f"clinic_visits_{start_date}_to_{end_date}.xlsx"
+    output = exporter.write_xlsx(db, start_date, end_date)
     return send_file(output,
-                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                     mimetype=exporter.XLSX_MIMETYPE,
                      as_attachment=True,
                      download_name=filename)
 
 @app.route('/api/import', methods=['POST'])
 def import_visits():
-    """Import visits from CSV or Excel file"""
+    """Start a background import of visits from a CSV or Excel file"""
+    import importer
+
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
 
@@ -349,60 +523,94 @@ def import_visits():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
 
+    if not importer.is_supported_file(file.filename):
+        return jsonify({'error': 'Unsupported file type. Please upload CSV or Excel file'}), 400
+
     try:
-        # Read file based on extension
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(file)
-        elif file.filename.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(file)
-        else:
-            return jsonify({'error': 'Unsupported file type. Please upload CSV or Excel file'}), 400
-
-        imported_count = 0
-        errors = []
-
-        for index, row in df.iterrows():
-            try:
-                # Prepare visit data
-                visit_data = {
-                    'date': str(row.get('date', '')),
-                    'start_time': str(row.get('start_time', '')),
-                    'end_time': str(row.get('end_time', '')),
-                    'active_duration': int(row.get('active_duration', 0)),
-                    'visit_type': str(row.get('visit_type', '')) if pd.notna(row.get('visit_type')) else '',
-                    'billing_code': str(row.get('billing_code', '')) if pd.notna(row.get('billing_code')) else '',
-                    'comments': str(row.get('comments', '')) if pd.notna(row.get('comments')) else '',
-                    'custom_fields': {}
-                }
-
-                # Validate required fields
-                if not visit_data['date'] or not visit_data['start_time']:
-                    errors.append(f"Row {index + 1}: Missing required fields (date or start_time)")
-                    continue
-
-                # Handle custom fields if present
-                for col in df.columns:
-                    if col not in ['date', 'start_time', 'end_time', 'active_duration',
-                                   'visit_type', 'billing_code', 'comments', 'day_of_week']:
-                        if pd.notna(row[col]):
-                            visit_data['custom_fields'][col] = str(row[col])
-
-                # Import visit
-                db.create_visit(visit_data)
-                imported_count += 1
-
-            except Exception as e:
-                errors.append(f"Row {index + 1}: {str(e)}")
+        # The upload stream closes with the request, so hand the job a copy on disk
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(file.filename)[1])
+        with os.fdopen(fd, 'wb') as f:
+            file.save(f)
+
+        job_id = importer.start_import_job(get_db(), path, file.filename)
 
         return jsonify({
             'success': True,
-            'imported': imported_count,
-            'errors': errors
-        })
+            'job_id': job_id,
+            'status': 'queued'
+        }), 202
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/import/<job_id>')
+def get_import_job(job_id):
+    """Get the status and progress of an import job"""
+    job = db.get_import_job(job_id)
+    if not job:
+        return jsonify({'error': 'Import job not found'}), 404
+    return jsonify(job)
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or migrate the database schema ahead of serving requests"""
+    for database in router.databases() if router else [default_db]:
+        database.init_db()
+    print('Database schema is up to date')
+
+@app.cli.command('add-provider')
+@click.argument('name')
+def add_provider_command(name):
+    """Create a provider's database in CLINIC_TRACKER_SHARD_DIR"""
+    if router is None:
+        raise click.UsageError('Set CLINIC_TRACKER_SHARD_DIR to enable provider databases')
+    try:
+        database = router.create_shard(name)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='NAME')
+    print(f'Provider database ready: {database.db_path}')
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the daily rollup tables from all stored visits"""
+    for database in router.databases() if router else [default_db]:
+        database.rebuild_daily_rollups()
+    print('Daily rollups rebuilt')
+
+@app.cli.command('recompute-wrvu')
+def recompute_wrvu_command():
+    """Re-price every visit from the fee schedule and rebuild the rollups"""
+    changed = sum(database.recompute_visit_wrvu()
+                  for database in (router.databases() if router else [default_db]))
+    print(f'Stored wRVU corrected on {changed} visits')
+
+@app.route('/metrics')
+def get_metrics():
+    """Request and SQL metrics of this worker process in Prometheus text format"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/admin/slow-queries', methods=['GET'])
+def get_slow_queries():
+    """Slowest logged SQL statements across all databases, worst first"""
+    limit = request.args.get('limit', 20, type=int)
+    queries = []
+    for database in router.databases() if router else [default_db]:
+        queries.extend(dict(query, database=database.db_path)
+                       for query in database.get_slow_queries(limit))
+    queries.sort(key=lambda query: query['max_ms'], reverse=True)
+
+    return jsonify({
+        'threshold_ms': DATABASE_OPTIONS['slow_query_ms'],
+        'queries': queries[:limit]
+    })
+
+@app.route('/api/admin/slow-queries', methods=['DELETE'])
+def clear_slow_queries():
+    """Empty the slow-query logs"""
+    for database in router.databases() if router else [default_db]:
+        database.clear_slow_queries()
+    return jsonify({'success': True})
+
 # QI Project routes
 @app.route('/qi-projects')
 def qi_projects():
@@ -428,13 +636,11 @@ def create_qi_project():
 
 @app.route('/api/qi-projects/<int:project_id>', methods=['GET'])
 def get_qi_project(project_id):
-    """Get a specific QI project with its entries"""
+    """Get a specific QI project; entries are paged from /entries"""
     project = db.get_qi_project(project_id)
     if not project:
         return jsonify({'error': 'Project not found'}), 404
 
-    entries = db.get_qi_project_entries(project_id)
-    project['entries'] = entries
     return jsonify(project)
 
 @app.route('/api/qi-projects/<int:project_id>', methods=['PUT'])
@@ -455,71 +661,97 @@ def delete_qi_project(project_id):
     db.delete_qi_project(project_id)
     return jsonify({'success': True})
 
+@app.route('/api/qi-projects/<int:project_id>/entries', methods=['GET'])
+def list_qi_project_entries(project_id):
+    """Page through a project's entries newest first.
+
+    Filter with created_from/created_to (dates, inclusive) and
+    var.<variable name>=<value>, repeatable to accept several values.
+    """
+    project = db.get_qi_project(project_id)
+    if not project:
+        return jsonify({'error': 'Project not found'}), 404
+
+    variable_names = {variable['name'] for variable in project['variables']}
+    filters = {}
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor, 2) if cursor else None
+
+        for key in request.args:
+            if key.startswith('var.'):
+                name = key[len('var.'):]
+                if name not in variable_names:
+                    raise ValueError(f'Unknown variable: {name}')
+                filters[name] = request.args.getlist(key)
+
+        # Fetch one extra entry to learn whether another page follows
+        entries = list(itertools.islice(db.iter_qi_project_entries(
+            project_id,
+            filters=filters,
+            created_from=request.args.get('created_from'),
+            created_to=request.args.get('created_to'),
+            after=after,
+            batch_size=limit + 1
+        ), limit + 1))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        last = entries[-1]
+        next_cursor = encode_cursor([last['created_at'], last['id']])
+
+    return jsonify({
+        'entries': entries,
+        'next_cursor': next_cursor
+    })
+
 @app.route('/api/qi-projects/<int:project_id>/entries', methods=['POST'])
 def create_qi_project_entry(project_id):
     """Create a new data entry for a QI project"""
     data = request.json
-    entry_id = db.create_qi_project_entry(project_id, data)
-    return jsonify({'id': entry_id, 'success': True})
+    entry = db.create_qi_project_entry(project_id, data)
+    return jsonify({'id': entry['id'], 'entry': entry, 'success': True})
 
 @app.route('/api/qi-projects/<int:project_id>/entries/<int:entry_id>', methods=['DELETE'])
 def delete_qi_project_entry(project_id, entry_id):
     """Delete a QI project data entry"""
-    db.delete_qi_project_entry(entry_id)
-    return jsonify({'success': True})
+    entry = db.delete_qi_project_entry(entry_id, project_id)
+    if not entry:
+        return jsonify({'error': 'Entry not found'}), 404
 
-@app.route('/api/qi-projects/<int:project_id>/export')
-def export_qi_project(project_id):
-    """Export QI project data to CSV"""
+    return jsonify({'entry': entry, 'success': True})
+
+@app.route('/api/qi-projects/<int:project_id>/analytics')
+def get_qi_project_analytics(project_id):
+    """Per-variable summary statistics and weekly run charts for a QI project"""
     project = db.get_qi_project(project_id)
     if not project:
         return jsonify({'error': 'Project not found'}), 404
 
-    entries = db.get_qi_project_entries(project_id)
-
-    # Prepare data for CSV export
-    if not entries:
-        return jsonify({'error': 'No data to export'}), 400
-
-    # Build column headers
-    headers = ['Entry ID', 'Created At']
-    for var in project['variables']:
-        headers.append(var['name'])
+    return jsonify(qi_stats.project_analytics(db, project))
 
-    export_data = []
-    for entry in entries:
-        row = {
-            'Entry ID': entry['id'],
-            'Created At': entry['created_at']
-        }
-        for var in project['variables']:
-            value = entry['data'].get(var['name'], '')
-            # Convert lists to semicolon-separated strings
-            if isinstance(value, list):
-                value = '; '.join(str(v) for v in value)
-            row[var['name']] = value
-
-        export_data.append(row)
+@app.route('/api/qi-projects/<int:project_id>/export')
+def export_qi_project(project_id):
+    """Stream QI project data as CSV"""
+    import exporter
 
-    df = pd.DataFrame(export_data)
+    project = db.get_qi_project(project_id)
+    if not project:
+        return jsonify({'error': 'Project not found'}), 404
 
-    output = BytesIO()
-    df.to_csv(output, index=False)
-    output.seek(0)
+    if not project['entry_count']:
+        return jsonify({'error': 'No data to export'}), 400
 
     filename = f"qi_project_{project['name'].replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    return send_file(output,
-                     mimetype='text/csv',
-                     as_attachment=True,
-                     download_name=filename)
+    return set_attachment(Response(exporter.iter_qi_csv(get_db(), project), mimetype='text/csv'), filename)
 
 @app.template_filter('format_duration')
 def format_duration_filter(seconds):
     return format_duration(seconds)
 
-@app.template_filter('calc_wrvu')
-def calc_wrvu_filter(billing_code):
-    return calculate_wrvu(billing_code)
-
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
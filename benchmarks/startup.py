@@ -0,0 +1,116 @@
+"""Startup benchmark: import time, time to first request and resident memory.
+
+Each run starts a fresh interpreter, imports app and serves one request
+through the Flask test client against a database in a scratch directory.
+Results are printed as JSON; budgets make the script exit non-zero on a
+regression, e.g.
+
+    python benchmarks/startup.py --runs 10 --max-import-ms 400 --max-rss-mb 80
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints one JSON object
+CHILD_CODE = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get(sys.argv[1])
+first_request = time.perf_counter()
+
+rss_kb = None
+try:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss_kb = int(line.split()[1])
+except OSError:
+    import resource
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss_kb //= 1024
+
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (first_request - imported) * 1000,
+    'rss_mb': rss_kb / 1024 if rss_kb else None,
+    'status': response.status_code,
+    'pandas_loaded': 'pandas' in sys.modules,
+    'openpyxl_loaded': 'openpyxl' in sys.modules,
+}))
+'''
+
+METRICS = ['import_ms', 'first_request_ms', 'rss_mb']
+
+
+def run_once(workdir, path):
+    """Start a fresh interpreter in workdir and return its measurements"""
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run([sys.executable, '-c', CHILD_CODE, path], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(runs):
+    """Median, min and max of each metric"""
+    summary = {}
+    for metric in METRICS:
+        values = [run[metric] for run in runs if run[metric] is not None]
+        if values:
+            summary[metric] = {
+                'median': statistics.median(values),
+                'min': min(values),
+                'max': max(values)
+            }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='timed runs (default 5)')
+    parser.add_argument('--path', default='/api/daily-visits', help='URL of the first request')
+    parser.add_argument('--fresh-db', action='store_true',
+                        help='start every run from an empty database (includes schema creation)')
+    parser.add_argument('--max-import-ms', type=float, help='fail if median import time exceeds this')
+    parser.add_argument('--max-first-request-ms', type=float,
+                        help='fail if median time to first request exceeds this')
+    parser.add_argument('--max-rss-mb', type=float, help='fail if median RSS exceeds this')
+    args = parser.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        if not args.fresh_db:
+            # Untimed run that creates the schema, as a deployed database already has it
+            run_once(workdir, args.path)
+
+        for _ in range(args.runs):
+            if args.fresh_db:
+                with tempfile.TemporaryDirectory() as run_dir:
+                    runs.append(run_once(run_dir, args.path))
+            else:
+                runs.append(run_once(workdir, args.path))
+
+    summary = summarize(runs)
+    print(json.dumps({'path': args.path, 'fresh_db': args.fresh_db,
+                      'summary': summary, 'runs': runs}, indent=2))
+
+    budgets = {'import_ms': args.max_import_ms, 'first_request_ms': args.max_first_request_ms,
+               'rss_mb': args.max_rss_mb}
+    failed = [f"{metric} median {summary[metric]['median']:.1f} > {budget}"
+              for metric, budget in budgets.items()
+              if budget is not None and metric in summary and summary[metric]['median'] > budget]
+    for message in failed:
+        print(f'Budget exceeded: {message}', file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""Benchmark suite for the hot paths, at several synthetic data sizes.
+
+For each size a seeded database is generated (see synthetic.py) and a fresh
+interpreter times the Database calls and the API routes through Flask's
+test client. Results are JSON, so runs from two commits can be compared:
+
+    python benchmarks/suite.py --years 0.5,2 --output before.json
+    python benchmarks/suite.py --years 0.5,2 --compare before.json --max-regression 1.25
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from io import BytesIO
+
+import synthetic
+from database import Database  # noqa: E402 (synthetic puts the repo on sys.path)
+
+REPO_ROOT = synthetic.REPO_ROOT
+
+DASHBOARD_PERIODS = ['today', 'week', 'month', 'last30', 'alltime']
+
+
+def time_call(function, repeat: int) -> dict:
+    """Run function once untimed, then `repeat` timed runs in milliseconds"""
+    function()
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        runs.append((time.perf_counter() - start) * 1000)
+    return {
+        'median_ms': statistics.median(runs),
+        'min_ms': min(runs),
+        'max_ms': max(runs),
+        'runs': len(runs)
+    }
+
+
+def run_benchmarks(repeat: int, import_rows: int, seed: int) -> dict:
+    """Time everything against CLINIC_TRACKER_DB; runs in the child interpreter"""
+    import app
+
+    db = app.default_db
+    client = app.app.test_client()
+    first_date, last_date = db.get_rollup_date_range()
+    projects = db.get_qi_projects()
+    project_id = max(projects, key=lambda project: project['entry_count'])['id']
+
+    def get(url):
+        def request():
+            response = client.get(url)
+            # Streamed bodies (CSV/NDJSON exports) are only produced when read
+            response.get_data()
+            response.close()
+            if response.status_code != 200:
+                raise RuntimeError(f'GET {url} returned {response.status_code}')
+        return request
+
+    last30 = (date.fromisoformat(last_date) - timedelta(days=30)).isoformat()
+    benchmarks = {
+        'db.get_visits': db.get_visits,
+        'db.get_visits[last30]': lambda: db.get_visits(last30, last_date),
+        'db.get_range_statistics': lambda: db.get_range_statistics(first_date, last_date),
+    }
+    for period in DASHBOARD_PERIODS:
+        benchmarks[f'GET /api/dashboard-data[{period}]'] = get(f'/api/dashboard-data?period={period}')
+    benchmarks['GET /api/dashboard-data[alltime,columnar]'] = get(
+        '/api/dashboard-data?period=alltime&layout=columnar')
+    benchmarks['GET /api/daily-visits'] = get(f'/api/daily-visits?date={last_date}')
+    for export_format in ('xlsx', 'csv', 'ndjson'):
+        benchmarks[f'GET /api/export[{export_format}]'] = get(
+            f'/api/export?format={export_format}&start_date={first_date}&end_date={last_date}')
+    benchmarks['GET /api/qi-projects/<id>'] = get(f'/api/qi-projects/{project_id}')
+    benchmarks['GET /api/qi-projects/<id>/entries'] = get(f'/api/qi-projects/{project_id}/entries')
+    benchmarks['GET /api/qi-projects/<id>/analytics'] = get(f'/api/qi-projects/{project_id}/analytics')
+
+    results = {name: time_call(function, repeat) for name, function in benchmarks.items()}
+
+    # Imports add visits, so they run last
+    with tempfile.TemporaryDirectory() as workdir:
+        import_path = os.path.join(workdir, 'import.csv')
+        synthetic.write_import_csv(import_path, import_rows, seed, date.fromisoformat(last_date))
+        with open(import_path, 'rb') as f:
+            upload = f.read()
+
+        def import_file():
+            response = client.post('/api/import', content_type='multipart/form-data',
+                                   data={'file': (BytesIO(upload), 'import.csv')})
+            job_id = response.get_json()['job_id']
+            # The import runs on a background thread; wait for it to finish
+            while True:
+                job = db.get_import_job(job_id)
+                if job['status'] in ('completed', 'failed'):
+                    break
+                time.sleep(0.005)
+            if job['status'] != 'completed':
+                raise RuntimeError(f"Import failed: {job.get('error')}")
+
+        results[f'POST /api/import[{import_rows} rows]'] = time_call(import_file, repeat)
+
+    return results
+
+
+def run_size(years: float, args) -> dict:
+    """Generate a database of `years` of data and benchmark it in a fresh interpreter"""
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'bench.db')
+        db = Database(db_path)
+        data = synthetic.populate(db, years, args.seed, args.visits_per_day,
+                                  args.qi_entries_per_week, args.end_date)
+        db.close()
+
+        env = dict(os.environ, CLINIC_TRACKER_DB=db_path, PYTHONDONTWRITEBYTECODE='1')
+        env.pop('CLINIC_TRACKER_SHARD_DIR', None)
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child',
+                                 '--repeat', str(args.repeat), '--import-rows', str(args.import_rows),
+                                 '--seed', str(args.seed)],
+                                cwd=workdir, env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise RuntimeError(f'Benchmarks failed at {years} years:\n{result.stderr}')
+
+    return {'years': years, 'data': data, 'results': json.loads(result.stdout.strip().splitlines()[-1])}
+
+
+def git_commit():
+    """The checked-out commit, or None outside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict) -> list:
+    """(years, benchmark, baseline ms, current ms, ratio) for benchmarks in both runs"""
+    baseline_sizes = {size['years']: size['results'] for size in baseline['sizes']}
+    rows = []
+    for size in current['sizes']:
+        before = baseline_sizes.get(size['years'], {})
+        for name, result in size['results'].items():
+            if before.get(name, {}).get('median_ms'):
+                old, new = before[name]['median_ms'], result['median_ms']
+                rows.append((size['years'], name, old, new, new / old))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--years', default='0.25,1,3',
+                        help='comma-separated data sizes in years (default 0.25,1,3)')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark (default 5)')
+    parser.add_argument('--seed', type=int, default=1, help='data generator seed (default 1)')
+    parser.add_argument('--visits-per-day', type=float, default=24,
+                        help='mean visits per clinic day (default 24)')
+    parser.add_argument('--qi-entries-per-week', type=float, default=20,
+                        help='mean entries per QI project per week (default 20)')
+    parser.add_argument('--import-rows', type=int, default=1000,
+                        help='rows in the timed import file (default 1000)')
+    parser.add_argument('--end-date', type=date.fromisoformat,
+                        help='last day of generated data (default today)')
+    parser.add_argument('--output', help='also write the results to this file')
+    parser.add_argument('--compare', help='results file from an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float,
+                        help='with --compare, fail if any median is this many times slower')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_benchmarks(args.repeat, args.import_rows, args.seed)))
+        return 0
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'visits_per_day': args.visits_per_day,
+            'qi_entries_per_week': args.qi_entries_per_week,
+            'import_rows': args.import_rows
+        },
+        'sizes': [run_size(float(years), args) for years in args.years.split(',')]
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    if not args.compare:
+        return 0
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+
+    failed = False
+    for years, name, old, new, ratio in compare(report, baseline):
+        regressed = args.max_regression is not None and ratio > args.max_regression
+        failed = failed or regressed
+        print(f"{years:>6g}y  {name:<45} {old:10.2f} -> {new:10.2f} ms  "
+              f"x{ratio:.2f}{'  REGRESSION' if regressed else ''}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
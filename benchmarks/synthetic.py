@@ -0,0 +1,249 @@
+"""Seeded synthetic clinic data for benchmarks.
+
+Generates weekday clinic sessions of visits with billing codes from
+WRVU_LOOKUP (well visits often billed together with a sick code and the
+25 modifier, stored as a JSON array like the encounter page does), visit
+types, custom field values and QI projects with weekly entries. The same
+seed and dates always produce the same data, e.g.
+
+    python benchmarks/synthetic.py --years 2 --seed 7 /tmp/bench.db
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from database import Database, WRVU_LOOKUP  # noqa: E402
+
+WELL_CODES = [code for code in WRVU_LOOKUP if code.startswith('993')]
+SICK_CODES = [code for code in WRVU_LOOKUP if code.startswith('992')]
+# Established visits dominate, and level 3-4 most of all
+SICK_CODE_WEIGHTS = [2, 3, 2, 1, 8, 30, 25, 5]
+
+WELL_VISIT_SHARE = 0.3
+# Share of well visits that also bill a sick problem (with the 25 modifier)
+WELL_PLUS_SICK_SHARE = 0.25
+# Share of sick visits that bill two codes
+SICK_MULTI_CODE_SHARE = 0.05
+
+# (field name, field type, options) as configured on the settings page
+CUSTOM_FIELDS = [
+    ('Location', 'dropdown', ['Main Clinic', 'North Clinic', 'Telehealth']),
+    ('Interpreter', 'dropdown', ['Yes', 'No']),
+    ('Patient Age', 'number', None),
+]
+
+QI_PROJECTS = [
+    {
+        'name': 'Asthma Action Plans',
+        'description': 'Action plan review at asthma visits',
+        'variables': [
+            {'name': 'Age', 'type': 'number', 'required': True},
+            {'name': 'Severity', 'type': 'dropdown', 'required': True,
+             'options': ['Intermittent', 'Mild', 'Moderate', 'Severe']},
+            {'name': 'Plan Reviewed', 'type': 'boolean', 'required': True},
+            {'name': 'Triggers', 'type': 'multiselect', 'required': False,
+             'options': ['Smoke', 'Pets', 'Dust', 'Exercise', 'Viral']},
+            {'name': 'Notes', 'type': 'text', 'required': False},
+        ]
+    },
+    {
+        'name': 'Developmental Screening',
+        'description': 'ASQ completion at well visits',
+        'variables': [
+            {'name': 'Age (months)', 'type': 'number', 'required': True},
+            {'name': 'ASQ Completed', 'type': 'boolean', 'required': True},
+            {'name': 'Referral', 'type': 'dropdown', 'required': False,
+             'options': ['None', 'Early Intervention', 'Speech', 'Developmental Peds']},
+            {'name': 'Visit Date', 'type': 'date', 'required': False},
+        ]
+    },
+]
+
+NOTES = ['', '', '', 'Follow up in 2 weeks', 'Parent concerned about sleep',
+         'Discussed inhaler technique', 'Needs refill']
+
+
+def _visit_codes(rng: random.Random) -> List[str]:
+    """Billing codes for one visit"""
+    if rng.random() < WELL_VISIT_SHARE:
+        codes = [rng.choice(WELL_CODES)]
+        if rng.random() < WELL_PLUS_SICK_SHARE:
+            codes += [rng.choices(SICK_CODES, SICK_CODE_WEIGHTS)[0], '25']
+        return codes
+
+    codes = [rng.choices(SICK_CODES, SICK_CODE_WEIGHTS)[0]]
+    if rng.random() < SICK_MULTI_CODE_SHARE:
+        codes.append(rng.choices(SICK_CODES, SICK_CODE_WEIGHTS)[0])
+    return codes
+
+
+def _custom_values(rng: random.Random) -> Dict[str, str]:
+    """Custom field values as the encounter form submits them (strings, blanks omitted)"""
+    values = {'Location': rng.choices(CUSTOM_FIELDS[0][2], [6, 3, 1])[0]}
+    if rng.random() < 0.15:
+        values['Interpreter'] = 'Yes'
+    elif rng.random() < 0.5:
+        values['Interpreter'] = 'No'
+    if rng.random() < 0.8:
+        values['Patient Age'] = str(rng.randint(0, 21))
+    return values
+
+
+def generate_visits(rng: random.Random, start: date, end: date,
+                    visits_per_day: float) -> Iterator[Dict]:
+    """Visit dicts for every weekday clinic session from start to end"""
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            clock = datetime.combine(day, datetime.min.time()).replace(hour=8)
+            for _ in range(max(0, round(rng.gauss(visits_per_day, visits_per_day / 5)))):
+                clock += timedelta(minutes=rng.randint(2, 10))
+                duration = max(60, int(rng.lognormvariate(6.6, 0.45)))
+                end_time = clock + timedelta(seconds=duration)
+
+                codes = _visit_codes(rng)
+                yield {
+                    'date': day.isoformat(),
+                    'start_time': clock.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                    'end_time': end_time.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                    'active_duration': duration,
+                    'visit_type': 'Well' if codes[0] in WELL_CODES else 'Sick',
+                    'billing_code': json.dumps(codes) if len(codes) > 1 else codes[0],
+                    'comments': rng.choice(NOTES),
+                    'custom_fields': _custom_values(rng)
+                }
+                clock = end_time
+        day += timedelta(days=1)
+
+
+def _qi_value(rng: random.Random, variable: Dict, day: date):
+    """A random value of a QI variable, as the project page would submit it"""
+    kind = variable['type']
+    if kind == 'number':
+        return rng.randint(1, 60) if 'month' in variable['name'] else rng.randint(2, 18)
+    if kind == 'dropdown':
+        return rng.choice(variable['options'])
+    if kind == 'multiselect':
+        return rng.sample(variable['options'], rng.randint(0, 3))
+    if kind == 'boolean':
+        return rng.choice(['Yes', 'Yes', 'No'])
+    if kind == 'date':
+        return day.isoformat()
+    return rng.choice(NOTES)
+
+
+def generate_qi_entries(rng: random.Random, project: Dict, start: date, end: date,
+                        entries_per_week: float) -> Iterator[tuple]:
+    """(data, created_at) pairs spread over the weekdays from start to end"""
+    per_day = entries_per_week / 5
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            for _ in range(max(0, round(rng.gauss(per_day, per_day / 3)))):
+                data = {variable['name']: _qi_value(rng, variable, day)
+                        for variable in project['variables']
+                        if variable['required'] or rng.random() < 0.7}
+                created = datetime.combine(day, datetime.min.time()) + timedelta(
+                    seconds=rng.randint(8 * 3600, 17 * 3600))
+                yield data, created.strftime('%Y-%m-%d %H:%M:%S')
+        day += timedelta(days=1)
+
+
+def populate(db: Database, years: float, seed: int = 1, visits_per_day: float = 24,
+             qi_entries_per_week: float = 20, end: Optional[date] = None) -> Dict:
+    """Fill an empty database with `years` of data ending at `end` (today).
+
+    Returns counts of what was written.
+    """
+    rng = random.Random(seed)
+    end = end or date.today()
+    start = end - timedelta(days=round(365 * years) - 1)
+
+    for name, field_type, options in CUSTOM_FIELDS:
+        db.create_custom_field(name, field_type, options)
+
+    visits, errors = db.create_visits_bulk(generate_visits(rng, start, end, visits_per_day))
+    if errors:
+        raise RuntimeError(f'Generated invalid visits: {errors[:3]}')
+
+    qi_entries = 0
+    for project in QI_PROJECTS:
+        project_id = db.create_qi_project(project['name'], project['description'],
+                                          project['variables'])
+        entries = list(generate_qi_entries(rng, project, start, end, qi_entries_per_week))
+        # Entries are back-dated, which create_qi_project_entry can't do,
+        # so they are written directly along with the project's entry count
+        with db.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO qi_project_data (project_id, data, created_at) VALUES (?, ?, ?)',
+                [(project_id, json.dumps(data), created_at) for data, created_at in entries])
+            conn.execute('UPDATE qi_projects SET entry_count = ? WHERE id = ?',
+                         (len(entries), project_id))
+        qi_entries += len(entries)
+
+    return {
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'visits': visits,
+        'qi_projects': len(QI_PROJECTS),
+        'qi_entries': qi_entries
+    }
+
+
+def write_import_csv(path: str, rows: int, seed: int = 1, end: Optional[date] = None):
+    """Write an import file of about `rows` visits in the import page's column layout"""
+    rng = random.Random(seed)
+    end = end or date.today()
+    names = [name for name, _, _ in CUSTOM_FIELDS]
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['date', 'start_time', 'end_time', 'active_duration',
+                         'visit_type', 'billing_code', 'comments'] + names)
+        written = 0
+        day = end - timedelta(days=max(1, rows // 20))
+        for visit in generate_visits(rng, day, end, 24):
+            writer.writerow([visit['date'], visit['start_time'], visit['end_time'],
+                             visit['active_duration'], visit['visit_type'],
+                             visit['billing_code'], visit['comments']] +
+                            [visit['custom_fields'].get(name, '') for name in names])
+            written += 1
+            if written >= rows:
+                break
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db_path', help='database file to create (must not exist)')
+    parser.add_argument('--years', type=float, default=1, help='years of visits (default 1)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default 1)')
+    parser.add_argument('--visits-per-day', type=float, default=24,
+                        help='mean visits per clinic day (default 24)')
+    parser.add_argument('--qi-entries-per-week', type=float, default=20,
+                        help='mean entries per QI project per week (default 20)')
+    parser.add_argument('--end-date', type=date.fromisoformat,
+                        help='last day of data (default today)')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db_path):
+        parser.error(f'{args.db_path} already exists')
+
+    db = Database(args.db_path)
+    summary = populate(db, args.years, args.seed, args.visits_per_day,
+                       args.qi_entries_per_week, args.end_date)
+    db.close()
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,18 @@
 import sqlite3
+import copy
 import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from datetime import datetime, date
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Iterable, Iterator, Tuple
 
 # wRVU lookup table
 WRVU_LOOKUP = {
@@ -26,113 +37,1417 @@ WRVU_LOOKUP = {
     '25': {'description': '25 Modifier', 'wrvu': 0.0},
 }
 
+# Effective date of the fee_schedule rows seeded from WRVU_LOOKUP, so they
+# price every visit that has no later schedule version
+FEE_SCHEDULE_START = '0001-01-01'
+
+
+class FeeSchedule:
+    """wRVU values by billing code, each with the dates it took effect.
+
+    A visit is priced with the version of each code in force on its date;
+    dates are ISO strings, so they compare in calendar order.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[str, str, float, Optional[str]]]):
+        # code -> ([effective dates], [(wrvu, description)]), in date order
+        self._versions = {}
+        for code, effective_date, wrvu, description in sorted(rows, key=lambda row: row[:2]):
+            dates, values = self._versions.setdefault(code, ([], []))
+            dates.append(effective_date)
+            values.append((wrvu, description))
+
+    @classmethod
+    def load(cls, conn) -> 'FeeSchedule':
+        """The schedule stored in a database's fee_schedule table"""
+        return cls(tuple(row) for row in conn.execute(
+            'SELECT code, effective_date, wrvu, description FROM fee_schedule'))
+
+    @classmethod
+    def default(cls) -> 'FeeSchedule':
+        """The built-in WRVU_LOOKUP values, in force from FEE_SCHEDULE_START"""
+        return cls((code, FEE_SCHEDULE_START, info['wrvu'], info['description'])
+                   for code, info in WRVU_LOOKUP.items())
+
+    def _index(self, code: str, on_date: Optional[str]) -> Optional[int]:
+        """Position of the code's version in force on a date, if any"""
+        versions = self._versions.get(code)
+        if versions is None:
+            return None
+        dates = versions[0]
+        # Visits without a date get the latest version
+        index = len(dates) - 1 if not on_date else bisect_right(dates, on_date) - 1
+        return index if index >= 0 else None
+
+    def wrvu(self, code: str, on_date: Optional[str] = None) -> float:
+        """wRVU of one billing code on a date (0 for unknown codes)"""
+        index = self._index(code, on_date)
+        return self._versions[code][1][index][0] if index is not None else 0.0
+
+    def visit_wrvu(self, codes: Iterable[str], on_date: Optional[str] = None) -> float:
+        """Total wRVU of a visit's billing codes on its date"""
+        return sum(self.wrvu(code.strip(), on_date) for code in codes)
+
+    def next_change(self, code: str, after: str) -> Optional[str]:
+        """Effective date of the first version of a code later than `after`"""
+        dates = self._versions.get(code, ([], []))[0]
+        index = bisect_right(dates, after)
+        return dates[index] if index < len(dates) else None
+
+    def lookup(self, on_date: Optional[str] = None) -> Dict[str, Dict]:
+        """Codes in force on a date, shaped like WRVU_LOOKUP plus effective_date"""
+        lookup = {}
+        for code, (dates, values) in self._versions.items():
+            index = self._index(code, on_date)
+            if index is not None:
+                wrvu, description = values[index]
+                lookup[code] = {'description': description or '', 'wrvu': wrvu,
+                                'effective_date': dates[index]}
+        return lookup
+
+    def versions(self) -> List[Dict]:
+        """Every version of every code, by code then effective date"""
+        return [{'code': code, 'effective_date': effective_date, 'wrvu': wrvu,
+                 'description': description or ''}
+                for code, (dates, values) in sorted(self._versions.items())
+                for effective_date, (wrvu, description) in zip(dates, values)]
+
+
+_DEFAULT_FEE_SCHEDULE = FeeSchedule.default()
+
+
+def _load_custom_fields(raw: Optional[str]) -> Dict:
+    """A visits.custom_fields column value as a dict ({} when empty or not a JSON object)"""
+    custom_fields = json.loads(raw) if raw else {}
+    return custom_fields if isinstance(custom_fields, dict) else {}
+
+
+# Daily rollups. daily_rollups holds per-day totals and daily_rollup_counts
+# holds per-day counters for each visit type, billing code, day of week and
+# custom field value (dimension, name, value). They are kept in step with the
+# visits table inside the same transaction as every visit write.
+def _visit_rollup_keys(visit: Dict) -> List[Tuple[str, str, str]]:
+    """The (dimension, name, value) counters a stored visit row contributes to"""
+    keys = []
+
+    if visit.get('visit_type'):
+        keys.append(('visit_type', '', visit['visit_type']))
+
+    for code in parse_billing_codes(visit.get('billing_code')):
+        code = code.strip()
+        if code:
+            keys.append(('billing_code', '', code))
+
+    if visit.get('day_of_week'):
+        keys.append(('day_of_week', '', visit['day_of_week']))
+
+    for field_name, field_value in _load_custom_fields(visit.get('custom_fields')).items():
+        keys.append(('custom_field', field_name, str(field_value)))
+
+    return keys
+
+
+def _apply_visit_rollups(conn, visits: Iterable[Dict], sign: int,
+                         schedule: Optional[FeeSchedule] = None):
+    """Add (sign=1) or remove (sign=-1) stored visit rows from the rollups.
+
+    wRVU comes from the fee schedule the visits are priced with (the
+    built-in values for databases that predate the fee_schedule table).
+    """
+    schedule = schedule or _DEFAULT_FEE_SCHEDULE
+    totals = defaultdict(lambda: [0, 0, 0.0])
+    counts = defaultdict(lambda: [0, 0, 0.0])
+
+    for visit in visits:
+        duration = visit.get('active_duration') or 0
+        wrvu = schedule.visit_wrvu(parse_billing_codes(visit.get('billing_code')), visit['date'])
+        day_totals = totals[visit['date']]
+        day_totals[0] += sign
+        day_totals[1] += sign * duration
+        day_totals[2] += sign * wrvu
+
+        for key in _visit_rollup_keys(visit):
+            counter = counts[(visit['date'],) + key]
+            counter[0] += sign
+            counter[1] += sign * duration
+            # A billing code counter carries that code's own wRVU, every
+            # other counter the whole visit's
+            counter[2] += sign * (schedule.wrvu(key[2], visit['date']) if key[0] == 'billing_code' else wrvu)
+
+    if not totals:
+        return
+
+    conn.executemany('''
+        INSERT INTO daily_rollups (date, visit_count, total_duration, total_wrvu)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (date) DO UPDATE SET
+            visit_count = visit_count + excluded.visit_count,
+            total_duration = total_duration + excluded.total_duration,
+            total_wrvu = total_wrvu + excluded.total_wrvu
+    ''', [(day,) + tuple(values) for day, values in totals.items()])
+
+    conn.executemany('''
+        INSERT INTO daily_rollup_counts (date, dimension, name, value, visit_count,
+                                         total_duration, total_wrvu)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (date, dimension, name, value) DO UPDATE SET
+            visit_count = visit_count + excluded.visit_count,
+            total_duration = total_duration + excluded.total_duration,
+            total_wrvu = total_wrvu + excluded.total_wrvu
+    ''', [key + tuple(values) for key, values in counts.items()])
+
+    if sign < 0:
+        days = [(day,) for day in totals]
+        conn.executemany('DELETE FROM daily_rollups WHERE date = ? AND visit_count <= 0', days)
+        conn.executemany('DELETE FROM daily_rollup_counts WHERE date = ? AND visit_count <= 0', days)
+
+
+def _rebuild_daily_rollups(conn, schedule: Optional[FeeSchedule] = None):
+    """Recompute the rollup tables from scratch"""
+    conn.execute('DELETE FROM daily_rollups')
+    conn.execute('DELETE FROM daily_rollup_counts')
+
+    cursor = conn.execute('SELECT * FROM visits')
+    while True:
+        rows = cursor.fetchmany(5000)
+        if not rows:
+            break
+        _apply_visit_rollups(conn, [dict(row) for row in rows], 1, schedule)
+
+
+def _rollup_statistics(visit_count: int, total_duration: int, total_wrvu: float,
+                       counts: Iterable) -> Dict:
+    """Build a statistics dict (get_range_statistics' shape) from rollup rows"""
+    if not visit_count:
+        return {
+            'total_visits': 0,
+            'avg_duration': 0,
+            'total_duration': 0,
+            'billing_codes': {},
+            'visit_types': {},
+            'custom_field_stats': {},
+            'total_wrvu': 0,
+            'avg_wrvu': 0,
+            'days_of_week': {}
+        }
+
+    billing_codes = {}
+    visit_types = {}
+    avg_by_type = {}
+    days_of_week = {}
+    custom_field_stats = defaultdict(dict)
+
+    for dimension, name, value, count, duration in counts:
+        if dimension == 'visit_type':
+            visit_types[value] = count
+            avg_by_type[value] = duration / count
+        elif dimension == 'billing_code':
+            billing_codes[value] = count
+        elif dimension == 'day_of_week':
+            days_of_week[value] = count
+        elif dimension == 'custom_field':
+            custom_field_stats[name][value] = count
+
+    return {
+        'total_visits': visit_count,
+        'avg_duration': total_duration / visit_count,
+        'total_duration': total_duration,
+        'billing_codes': billing_codes,
+        'visit_types': visit_types,
+        'avg_by_type': avg_by_type,
+        'custom_field_stats': dict(custom_field_stats),
+        'total_wrvu': total_wrvu,
+        'avg_wrvu': total_wrvu / visit_count,
+        'days_of_week': days_of_week
+    }
+
+
+def _date_range_clause(start_date: Optional[str], end_date: Optional[str],
+                       column: str = 'date') -> Tuple[str, tuple]:
+    """WHERE clause matching get_visits' handling of optional range bounds"""
+    if start_date and end_date:
+        return f'WHERE {column} BETWEEN ? AND ?', (start_date, end_date)
+    if start_date:
+        return f'WHERE {column} >= ?', (start_date,)
+    return '', ()
+
+
+def _add_condition(where: str, condition: str) -> str:
+    """Append a condition to a WHERE clause from _date_range_clause"""
+    return f'{where} AND {condition}' if where else f'WHERE {condition}'
+
+
+# aggregate_visits groupings that make up a get_range_statistics result
+STATISTICS_GROUPS = [[], ['visit_type'], ['billing_code'], ['day_of_week'], ['custom_field']]
+
+# Metric columns of aggregate_visits rows; every other column is a group value
+_AGGREGATE_METRIC_COLUMNS = ('visit_count', 'total_duration', 'avg_duration', 'total_wrvu')
+
+
+def _statistics_from_aggregates(rows_by_group: Dict[tuple, List[Dict]]) -> Dict:
+    """Build summary statistics from aggregate_visits rows for STATISTICS_GROUPS"""
+    totals = rows_by_group[()]
+    if not totals:
+        return _rollup_statistics(0, 0, 0.0, [])
+
+    counts = []
+    for dimension in ('visit_type', 'billing_code', 'day_of_week'):
+        for row in rows_by_group[(dimension,)]:
+            counts.append((dimension, '', row[dimension],
+                           row['visit_count'], row['total_duration']))
+
+    for row in rows_by_group[('custom_field',)]:
+        counts.append(('custom_field', row['field_name'], row['field_value'],
+                       row['visit_count'], row['total_duration']))
+
+    return _rollup_statistics(totals[0]['visit_count'], totals[0]['total_duration'],
+                              totals[0]['total_wrvu'], counts)
+
+
+def _merge_aggregate_rows(row_lists: Iterable[List[Dict]]) -> List[Dict]:
+    """Combine aggregate_visits results from several databases group by group"""
+    merged = {}
+    for rows in row_lists:
+        for row in rows:
+            key = tuple((name, value) for name, value in row.items()
+                        if name not in _AGGREGATE_METRIC_COLUMNS)
+            total = merged.get(key)
+            if total is None:
+                merged[key] = dict(row)
+            else:
+                total['visit_count'] += row['visit_count']
+                total['total_duration'] += row['total_duration']
+                total['total_wrvu'] += row['total_wrvu']
+
+    for row in merged.values():
+        row['avg_duration'] = row['total_duration'] / row['visit_count'] if row['visit_count'] else 0
+    return list(merged.values())
+
+
+# Key of each rollup dimension in get_range_statistics results
+ROLLUP_CATEGORY_KEYS = {
+    'visit_type': 'visit_types',
+    'billing_code': 'billing_codes',
+    'day_of_week': 'days_of_week',
+    'custom_field': 'custom_field_stats',
+}
+
+# group_by values accepted by Database.aggregate_visits
+AGGREGATE_DIMENSIONS = ['date', 'visit_type', 'billing_code', 'day_of_week', 'custom_field']
+
+_AGGREGATE_METRICS = '''
+    SUM({count}) AS visit_count,
+    SUM({duration}) AS total_duration,
+    CAST(SUM({duration}) AS REAL) / SUM({count}) AS avg_duration,
+    SUM({wrvu}) AS total_wrvu
+'''
+
+
+def _rollup_aggregate_query(start_date: Optional[str], end_date: Optional[str],
+                            group_by: List[str]) -> Tuple[str, tuple]:
+    """Aggregate over the daily rollups (date plus at most one other dimension)"""
+    where, params = _date_range_clause(start_date, end_date)
+    metrics = _AGGREGATE_METRICS.format(count='visit_count', duration='total_duration',
+                                        wrvu='total_wrvu')
+    dimensions = [g for g in group_by if g != 'date']
+
+    if not dimensions:
+        table = 'daily_rollups'
+        columns = ['date'] if 'date' in group_by else []
+        groups = list(columns)
+    else:
+        table = 'daily_rollup_counts'
+        where = _add_condition(where, 'dimension = ?')
+        params += (dimensions[0],)
+
+        columns = []
+        groups = []
+        for g in group_by:
+            if g == 'date':
+                columns.append('date')
+                groups.append('date')
+            elif g == 'custom_field':
+                columns += ['name AS field_name', 'value AS field_value']
+                groups += ['name', 'value']
+            else:
+                columns.append(f'value AS {g}')
+                groups.append('value')
+
+    # An ungrouped query always returns its one totals row (SQLite before
+    # 3.39 rejects HAVING without GROUP BY); aggregate_visits drops it when
+    # the range has no visits
+    group_clause = f"GROUP BY {', '.join(groups)} HAVING SUM(visit_count) > 0" if groups else ''
+    order_clause = f"ORDER BY {', '.join(groups)}" if groups else ''
+    query = f'''
+        SELECT {', '.join(columns + [metrics])}
+        FROM {table}
+        {where}
+        {group_clause}
+        {order_clause}
+    '''
+    return query, params
+
+
+def _visit_aggregate_query(start_date: Optional[str], end_date: Optional[str],
+                           group_by: List[str]) -> Tuple[str, tuple]:
+    """Aggregate straight over visits, for groupings the rollups don't cover"""
+    where, params = _date_range_clause(start_date, end_date, 'v.date')
+    columns = []
+    groups = []
+    joins = []
+
+    for g in group_by:
+        if g == 'billing_code':
+            joins.append('JOIN visit_billing_codes bc ON bc.visit_id = v.id')
+            columns.append('bc.code AS billing_code')
+            groups.append('bc.code')
+        elif g == 'custom_field':
+            joins.append('JOIN visit_custom_values cv ON cv.visit_id = v.id')
+            columns += ['cv.field_name AS field_name', 'cv.value AS field_value']
+            groups += ['cv.field_name', 'cv.value']
+        else:
+            columns.append(f'v.{g} AS {g}')
+            groups.append(f'v.{g}')
+            if g != 'date':
+                where = _add_condition(where, f"v.{g} IS NOT NULL AND v.{g} != ''")
+
+    wrvu = 'bc.wrvu' if 'billing_code' in group_by else 'v.wrvu'
+    metrics = _AGGREGATE_METRICS.format(count='1', duration='COALESCE(v.active_duration, 0)',
+                                        wrvu=wrvu)
+
+    query = f'''
+        SELECT {', '.join(columns + [metrics])}
+        FROM visits v
+        {' '.join(joins)}
+        {where}
+        GROUP BY {', '.join(groups)}
+        ORDER BY {', '.join(groups)}
+    '''
+    return query, params
+
+
+# Normalized billing codes. visit_billing_codes holds one row per code on a
+# visit (duplicates kept, in their original order) so code lookups and
+# aggregates don't need to re-parse visits.billing_code.
+def _billing_code_rows(visit_id: int, billing_code: Optional[str]) -> List[Tuple[int, int, str]]:
+    """visit_billing_codes rows for one visit's stored billing_code value"""
+    codes = [code.strip() for code in parse_billing_codes(billing_code)]
+    return [(visit_id, position, code) for position, code in enumerate(c for c in codes if c)]
+
+
+def _write_visit_billing_codes(conn, visits: Iterable[Tuple[int, Optional[str]]]):
+    """Insert visit_billing_codes rows for (visit_id, billing_code) pairs"""
+    rows = [row for visit_id, billing_code in visits
+            for row in _billing_code_rows(visit_id, billing_code)]
+    if rows:
+        conn.executemany('''
+            INSERT INTO visit_billing_codes (visit_id, position, code)
+            VALUES (?, ?, ?)
+        ''', rows)
+
+
+def _write_priced_billing_codes(conn, visits: Iterable[Tuple[int, Optional[str], Optional[str]]],
+                                schedule: FeeSchedule):
+    """Insert priced visit_billing_codes rows for (visit_id, billing_code, date) triples"""
+    rows = [(visit_id, position, code, schedule.wrvu(code, visit_date))
+            for visit_id, billing_code, visit_date in visits
+            for visit_id, position, code in _billing_code_rows(visit_id, billing_code)]
+    if rows:
+        conn.executemany('''
+            INSERT INTO visit_billing_codes (visit_id, position, code, wrvu)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+
+
+# Custom field values. visit_custom_values holds one row per field on a
+# visit, keyed by field name (imports can bring fields that have no
+# definition in custom_fields). value is the text the statistics count by;
+# numeric_value is filled in when the value is a number so ranges can be
+# queried.
+def _custom_value_rows(visit_id: int, custom_fields: Optional[Dict]) -> List[tuple]:
+    """visit_custom_values rows for one visit's custom field dict"""
+    rows = []
+    for field_name, field_value in (custom_fields or {}).items():
+        try:
+            numeric_value = float(field_value) if not isinstance(field_value, bool) else None
+        except (TypeError, ValueError):
+            numeric_value = None
+        rows.append((visit_id, field_name, str(field_value), numeric_value))
+    return rows
+
+
+def _write_visit_custom_values(conn, visits: Iterable[Tuple[int, Optional[Dict]]]):
+    """Insert visit_custom_values rows for (visit_id, custom_fields) pairs"""
+    rows = [row for visit_id, custom_fields in visits
+            for row in _custom_value_rows(visit_id, custom_fields)]
+    if rows:
+        conn.executemany('''
+            INSERT OR REPLACE INTO visit_custom_values (visit_id, field_name, value, numeric_value)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+
+
+# Schema migrations, applied in order. The list index + 1 is the schema
+# version recorded in PRAGMA user_version once that migration has run, so
+# never reorder or edit a released migration - append a new one instead.
+def _migration_initial_schema(conn):
+    """Base tables (also adopts databases created before versioning)"""
+    cursor = conn.cursor()
+
+    # Visits table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS visits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT,
+            active_duration INTEGER DEFAULT 0,
+            visit_type TEXT,
+            billing_code TEXT,
+            comments TEXT,
+            custom_fields TEXT,
+            day_of_week TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Custom fields configuration table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS custom_fields (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            field_name TEXT NOT NULL UNIQUE,
+            field_type TEXT NOT NULL,
+            options TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Days table for tracking work days
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS work_days (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL UNIQUE,
+            notes TEXT,
+            ended_at TEXT
+        )
+    ''')
+
+    # Settings table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT NOT NULL UNIQUE,
+            value TEXT NOT NULL,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # QI Projects table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS qi_projects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            variables TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # QI Project Data table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS qi_project_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (project_id) REFERENCES qi_projects (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # Add day_of_week column to visits tables created before it existed
+    columns = [row['name'] for row in cursor.execute('PRAGMA table_info(visits)')]
+    if 'day_of_week' not in columns:
+        cursor.execute('ALTER TABLE visits ADD COLUMN day_of_week TEXT')
+
+    # Initialize default wRVU conversion rate if not set
+    cursor.execute('INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)',
+                   ('wrvu_conversion_rate', '36.00'))
+
+
+def _migration_range_indexes(conn):
+    """Indexes for the date-range visit queries and per-project QI entry lists"""
+    # Serves WHERE date BETWEEN ... ORDER BY date DESC, start_time DESC
+    # without a separate sort step
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_visits_date_start_time
+        ON visits (date, start_time)
+    ''')
+    # Serves WHERE project_id = ? ORDER BY created_at DESC
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_qi_project_data_project_created
+        ON qi_project_data (project_id, created_at)
+    ''')
+    conn.execute('ANALYZE')
+
+
+def _migration_import_jobs(conn):
+    """Progress and results of background file imports"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id TEXT PRIMARY KEY,
+            filename TEXT,
+            status TEXT NOT NULL,
+            total_rows INTEGER,
+            processed_rows INTEGER DEFAULT 0,
+            imported INTEGER DEFAULT 0,
+            error_count INTEGER DEFAULT 0,
+            errors TEXT,
+            error TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            finished_at TEXT
+        )
+    ''')
+
+
+def _migration_daily_rollups(conn):
+    """Per-day visit rollups for the dashboard.
+
+    Existing visits are backfilled by _migration_rollup_wrvu, once
+    daily_rollup_counts has the total_wrvu column the rollup code writes.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_rollups (
+            date TEXT PRIMARY KEY,
+            visit_count INTEGER NOT NULL DEFAULT 0,
+            total_duration INTEGER NOT NULL DEFAULT 0,
+            total_wrvu REAL NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_rollup_counts (
+            date TEXT NOT NULL,
+            dimension TEXT NOT NULL,
+            name TEXT NOT NULL DEFAULT '',
+            value TEXT NOT NULL,
+            visit_count INTEGER NOT NULL DEFAULT 0,
+            total_duration INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (date, dimension, name, value)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _migration_visit_billing_codes(conn):
+    """Child table of individual billing codes, converted from visits.billing_code"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS visit_billing_codes (
+            visit_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            code TEXT NOT NULL,
+            PRIMARY KEY (visit_id, position),
+            FOREIGN KEY (visit_id) REFERENCES visits (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_visit_billing_codes_code
+        ON visit_billing_codes (code, visit_id)
+    ''')
+
+    conn.execute('DELETE FROM visit_billing_codes')
+    cursor = conn.execute("SELECT id, billing_code FROM visits WHERE billing_code IS NOT NULL AND billing_code != ''")
+    while True:
+        rows = cursor.fetchmany(5000)
+        if not rows:
+            break
+        _write_visit_billing_codes(conn, [(row['id'], row['billing_code']) for row in rows])
+
+
+def _migration_rollup_wrvu(conn):
+    """wRVU totals on rollup counters, and the backfill of the rollup tables"""
+    columns = [row['name'] for row in conn.execute('PRAGMA table_info(daily_rollup_counts)')]
+    if 'total_wrvu' not in columns:
+        conn.execute('ALTER TABLE daily_rollup_counts ADD COLUMN total_wrvu REAL NOT NULL DEFAULT 0')
+    _rebuild_daily_rollups(conn)
+
+
+def _migration_visit_custom_values(conn):
+    """Indexed custom field values, converted from visits.custom_fields JSON"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS visit_custom_values (
+            visit_id INTEGER NOT NULL,
+            field_name TEXT NOT NULL,
+            value TEXT,
+            numeric_value REAL,
+            PRIMARY KEY (visit_id, field_name),
+            FOREIGN KEY (visit_id) REFERENCES visits (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_visit_custom_values_field_value
+        ON visit_custom_values (field_name, value, visit_id)
+    ''')
+
+    conn.execute('DELETE FROM visit_custom_values')
+    cursor = conn.execute("SELECT id, custom_fields FROM visits WHERE custom_fields IS NOT NULL AND custom_fields != '{}'")
+    while True:
+        rows = cursor.fetchmany(5000)
+        if not rows:
+            break
+        _write_visit_custom_values(conn, [(row['id'], _load_custom_fields(row['custom_fields'])) for row in rows])
+
+
+# Current UTC time as stored in data_versions.updated_at
+_UTC_NOW_SQL = "strftime('%Y-%m-%dT%H:%M:%SZ', 'now')"
+
+
+def _migration_data_versions(conn):
+    """Counters bumped on every change to a group of tables, for cache invalidation"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES ('config', 1)")
+
+
+def _migration_visit_data_version(conn):
+    """Timestamp data version changes and add a 'visits' version for HTTP validators"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(data_versions)')]
+    if 'updated_at' not in columns:
+        conn.execute('ALTER TABLE data_versions ADD COLUMN updated_at TEXT')
+    conn.execute(f"UPDATE data_versions SET updated_at = {_UTC_NOW_SQL} WHERE updated_at IS NULL")
+    conn.execute(f"""
+        INSERT OR IGNORE INTO data_versions (name, version, updated_at)
+        VALUES ('visits', 1, {_UTC_NOW_SQL})
+    """)
+
+
+def _migration_qi_entry_count(conn):
+    """Denormalized per-project entry count, kept up to date on entry writes"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(qi_projects)')]
+    if 'entry_count' not in columns:
+        conn.execute('ALTER TABLE qi_projects ADD COLUMN entry_count INTEGER NOT NULL DEFAULT 0')
+    conn.execute('''
+        UPDATE qi_projects SET entry_count = (
+            SELECT COUNT(*) FROM qi_project_data WHERE project_id = qi_projects.id
+        )
+    ''')
+
+
+def _migration_fee_schedule(conn):
+    """Dated wRVU fee schedule seeded from WRVU_LOOKUP, and wRVU stored on visits"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fee_schedule (
+            code TEXT NOT NULL,
+            effective_date TEXT NOT NULL,
+            wrvu REAL NOT NULL,
+            description TEXT NOT NULL DEFAULT '',
+            PRIMARY KEY (code, effective_date)
+        ) WITHOUT ROWID
+    ''')
+    conn.executemany('''
+        INSERT OR IGNORE INTO fee_schedule (code, effective_date, wrvu, description)
+        VALUES (?, ?, ?, ?)
+    ''', [(code, FEE_SCHEDULE_START, info['wrvu'], info['description'])
+          for code, info in WRVU_LOOKUP.items()])
+
+    for table in ('visits', 'visit_billing_codes'):
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+        if 'wrvu' not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN wrvu REAL NOT NULL DEFAULT 0')
+
+    # Only the seeded versions exist yet, so each code has a single value
+    conn.execute('''
+        UPDATE visit_billing_codes SET wrvu = COALESCE(
+            (SELECT wrvu FROM fee_schedule WHERE code = visit_billing_codes.code), 0)
+    ''')
+    conn.execute('''
+        UPDATE visits SET wrvu = (
+            SELECT COALESCE(SUM(wrvu), 0) FROM visit_billing_codes WHERE visit_id = visits.id
+        )
+    ''')
+    conn.execute(f"""
+        INSERT OR IGNORE INTO data_versions (name, version, updated_at)
+        VALUES ('fee_schedule', 1, {_UTC_NOW_SQL})
+    """)
+
+
+MIGRATIONS = [
+    _migration_initial_schema,
+    _migration_range_indexes,
+    _migration_import_jobs,
+    _migration_daily_rollups,
+    _migration_visit_billing_codes,
+    _migration_rollup_wrvu,
+    _migration_visit_custom_values,
+    _migration_data_versions,
+    _migration_visit_data_version,
+    _migration_qi_entry_count,
+    _migration_fee_schedule,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Monday starting the week of a QI entry's created_at
+_QI_WEEK_SQL = "date(d.created_at, 'weekday 0', '-6 days')"
+
+VISIT_INSERT_COLUMNS = ['date', 'start_time', 'end_time', 'active_duration', 'visit_type',
+                        'billing_code', 'comments', 'custom_fields', 'day_of_week', 'wrvu']
+
+INSERT_VISIT_SQL = '''
+    INSERT INTO visits (date, start_time, end_time, active_duration,
+                        visit_type, billing_code, comments, custom_fields, day_of_week, wrvu)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Visits re-priced per statement batch after a fee schedule change
+REPRICE_BATCH_SIZE = 500
+
+# Seconds a process trusts its cached settings/custom fields before checking
+# the persisted config version for changes made by other processes
+CONFIG_CHECK_INTERVAL = 2.0
+
+# Run PRAGMA optimize on a pooled connection every this many checkouts
+OPTIMIZE_INTERVAL = 1000
+
+# Seconds a caller waits for the writer thread to start its write. A write
+# still queued by then is cancelled; one already running is waited for.
+WRITE_TIMEOUT = 30.0
+
+# Shard names double as file names, so only allow safe characters
+SHARD_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Shards queried at once by DatabaseRouter's cross-shard aggregation
+SHARD_QUERY_THREADS = 8
+
+# Distinct statements kept in a Database's slow-query log
+SLOW_QUERY_LOG_SIZE = 50
+
+# Statements worth an EXPLAIN QUERY PLAN when they run slowly
+_EXPLAINABLE_PATTERN = re.compile(r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+# Plan steps that walk a whole table (or a whole index of it) rather than
+# searching one; an ORDER BY index scan may stop early at a LIMIT
+_FULL_SCAN_PATTERN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+logger = logging.getLogger(__name__)
+
+
+def parameter_shapes(parameters) -> Any:
+    """Types (and string lengths) of bound parameters, never their values"""
+    def shape(value):
+        if isinstance(value, (str, bytes)):
+            return f'{type(value).__name__}({len(value)})'
+        return type(value).__name__
+
+    if parameters is None:
+        return None
+    if isinstance(parameters, dict):
+        return {name: shape(value) for name, value in parameters.items()}
+    return [shape(value) for value in parameters]
+
+
+class _InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times each statement and reports it to its Database.
+
+    A query's time includes fetching its rows, so it is reported once the
+    rows run out, the cursor runs another statement or it is discarded.
+    """
+    # [sql, parameters, seconds, rows] of the statement still being fetched
+    _pending = None
+
+    def execute(self, sql, parameters=()):
+        self._report()
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._pending = [sql, parameters, time.perf_counter() - start, 0]
+        if self.description is None:
+            # Not a query, so there is nothing left to fetch
+            self._report()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._report()
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._pending = [sql, None, time.perf_counter() - start, max(self.rowcount, 0)]
+        self._report()
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 0 if row is None else 1, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(start, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0, True)
+            raise
+        self._fetched(start, 1, False)
+        return row
+
+    def close(self):
+        self._report()
+        super().close()
+
+    def __del__(self):
+        self._report()
+
+    def _fetched(self, start: float, rows: int, done: bool):
+        pending = self._pending
+        if pending is not None:
+            pending[2] += time.perf_counter() - start
+            pending[3] += rows
+            if done:
+                self._report()
+
+    def _report(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            self.connection.database._query_finished(self.connection, *pending)
+
+
+class _InstrumentedConnection(sqlite3.Connection):
+    """Connection whose statements go through _InstrumentedCursor"""
+    database = None
+
+    def cursor(self, factory=_InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
 class Database:
-    def __init__(self, db_path='clinic_tracker.db'):
+    def __init__(self, db_path='clinic_tracker.db', pool_size=8,
+                 cache_size_kb=8192, mmap_size=64 * 1024 * 1024,
+                 statement_cache_size=256, write_queue=False,
+                 write_batch_size=64, query_listeners=None, slow_query_ms=None):
         self.db_path = db_path
-        self.init_db()
-
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path, timeout=10.0)
+        self.pool_size = pool_size
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.statement_cache_size = statement_cache_size
+        # Route visit and QI entry writes through one writer thread
+        self.write_queue = write_queue
+        self.write_batch_size = write_batch_size
+        # Callables notified of every statement as (database, sql, parameters,
+        # seconds, rows); None leaves connections uninstrumented
+        self.query_listeners = query_listeners
+        # Statements slower than this are logged with their query plan;
+        # None turns the slow-query log off
+        self.slow_query_ms = slow_query_ms
+        self._slow_queries = {}
+        self._slow_query_lock = threading.Lock()
+
+        self._config_cache = None
+        self._fee_schedule_cache = None
+        self._inherited_pools = []
+        self._reset_pool()
+
+        # The schema is brought up to date on first use rather than here, so
+        # constructing a Database (e.g. at import time) does no I/O
+        self._schema_lock = threading.RLock()
+        self._schema_ready = False
+        self._schema_migrating = False
+
+    # Connection pool
+    def _reset_pool(self):
+        """Start an empty pool owned by the current process"""
+        self._pool = queue.LifoQueue(maxsize=self.pool_size)
+        self._pool_lock = threading.Lock()
+        self._pool_created = 0
+        self._checkouts = 0
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._writer = None
+        self._writer_jobs = None
+        self._writer_lock = threading.Lock()
+
+    def _after_fork(self):
+        """Drop connections inherited from the parent process (e.g. a preloading server).
+
+        SQLite connections must not be used across fork(). They are kept
+        referenced rather than closed, since closing them here could release
+        locks the parent still relies on.
+        """
+        self._inherited_pools.append(self._pool)
+        self._reset_pool()
+        self._schema_lock = threading.RLock()
+        self._schema_migrating = False
+
+    def _connect(self):
+        """Open a new connection with the tuned pragmas applied"""
+        instrumented = self.query_listeners is not None or self.slow_query_ms is not None
+        conn = sqlite3.connect(self.db_path, timeout=10.0,
+                               isolation_level=None,
+                               check_same_thread=False,
+                               cached_statements=self.statement_cache_size,
+                               factory=_InstrumentedConnection if instrumented else sqlite3.Connection)
+        if instrumented:
+            conn.database = self
         conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
         return conn
 
-    def init_db(self):
-        """Initialize database tables"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        # Visits table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS visits (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT NOT NULL,
-                start_time TEXT NOT NULL,
-                end_time TEXT,
-                active_duration INTEGER DEFAULT 0,
-                visit_type TEXT,
-                billing_code TEXT,
-                comments TEXT,
-                custom_fields TEXT,
-                day_of_week TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # Custom fields configuration table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS custom_fields (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                field_name TEXT NOT NULL UNIQUE,
-                field_type TEXT NOT NULL,
-                options TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # Days table for tracking work days
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS work_days (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT NOT NULL UNIQUE,
-                notes TEXT,
-                ended_at TEXT
-            )
-        ''')
-
-        # Settings table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS settings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                key TEXT NOT NULL UNIQUE,
-                value TEXT NOT NULL,
-                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # QI Projects table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS qi_projects (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                variables TEXT NOT NULL,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-
-        # QI Project Data table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS qi_project_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                project_id INTEGER NOT NULL,
-                data TEXT NOT NULL,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (project_id) REFERENCES qi_projects (id) ON DELETE CASCADE
-            )
-        ''')
-
-        # Add day_of_week column to existing visits table if it doesn't exist
+    def _acquire(self):
+        """Take an idle connection from the pool, opening one if the pool isn't full yet"""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._pool_lock:
+            if self._pool_created < self.pool_size:
+                self._pool_created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._pool_lock:
+                    self._pool_created -= 1
+                raise
+
+        # Pool exhausted - wait for another thread to hand one back
+        return self._pool.get(timeout=30.0)
+
+    def _release(self, conn):
+        """Return a connection to the pool"""
+        if conn.in_transaction:
+            conn.rollback()
+
+        # Statistics gathered by ANALYZE while a table was small steer the
+        # planner away from the indexes once it grows, so let SQLite refresh
+        # them now and then on the long-lived connections
+        self._checkouts += 1
+        if self._checkouts % OPTIMIZE_INTERVAL == 0:
+            conn.execute('PRAGMA optimize')
+
+        self._pool.put_nowait(conn)
+
+    def _query_finished(self, conn, sql: str, parameters, seconds: float, rows: int):
+        """Pass a finished statement's timing to the query listeners and slow-query log"""
+        for listener in self.query_listeners or ():
+            listener(self, sql, parameters, seconds, rows)
+
+        if self.slow_query_ms is not None and seconds * 1000 >= self.slow_query_ms:
+            self._log_slow_query(conn, sql, parameters, seconds, rows)
+
+    def _log_slow_query(self, conn, sql: str, parameters, seconds: float, rows: int):
+        """Record a slow statement, capturing its plan when it is the slowest run so far"""
+        statement = ' '.join(sql.split())
+        duration_ms = seconds * 1000
+        shapes = parameter_shapes(parameters)
+
+        with self._slow_query_lock:
+            entry = self._slow_queries.get(statement)
+            explain = entry is None or duration_ms > entry['max_ms']
+
+        plan = self._explain(conn, sql, parameters) if explain else None
+        logger.warning('Slow query (%.1f ms, %d rows) on %s: %s params=%s plan=%s',
+                       duration_ms, rows, self.db_path, statement, shapes,
+                       ' | '.join(plan) if plan is not None else 'unchanged')
+
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._slow_query_lock:
+            entry = self._slow_queries.get(statement)
+            if entry is None:
+                if len(self._slow_queries) >= SLOW_QUERY_LOG_SIZE:
+                    # Make room by forgetting the statement with the lowest worst case
+                    del self._slow_queries[min(self._slow_queries,
+                                               key=lambda key: self._slow_queries[key]['max_ms'])]
+                entry = self._slow_queries[statement] = {
+                    'sql': statement, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'first_seen': now, 'plan': [], 'full_scans': []
+                }
+
+            entry['count'] += 1
+            entry['total_ms'] += duration_ms
+            entry['last_seen'] = now
+            if duration_ms > entry['max_ms']:
+                entry.update(max_ms=duration_ms, rows=rows, parameters=shapes)
+                if plan is not None:
+                    entry['plan'] = plan
+                    entry['full_scans'] = [match.group(1) for match in map(_FULL_SCAN_PATTERN.match, plan)
+                                           if match]
+
+    def _explain(self, conn, sql: str, parameters) -> List[str]:
+        """EXPLAIN QUERY PLAN steps of a statement, on the connection that ran it"""
+        if not _EXPLAINABLE_PATTERN.match(sql):
+            return []
+        if parameters is None:
+            # executemany: only the statement shape matters to the plan
+            parameters = [None] * sql.count('?')
+        try:
+            # A plain cursor, so the EXPLAIN isn't itself timed and reported
+            cursor = sqlite3.Connection.cursor(conn, sqlite3.Cursor)
+            return [row[3] for row in cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parameters)]
+        except sqlite3.Error as e:
+            return [f'EXPLAIN failed: {e}']
+
+    def get_slow_queries(self, limit: int = 20) -> List[Dict]:
+        """The slowest logged statements, worst first"""
+        with self._slow_query_lock:
+            entries = [dict(entry, avg_ms=entry['total_ms'] / entry['count'])
+                       for entry in self._slow_queries.values()]
+        entries.sort(key=lambda entry: entry['max_ms'], reverse=True)
+        return entries[:limit]
+
+    def clear_slow_queries(self):
+        """Empty the slow-query log"""
+        with self._slow_query_lock:
+            self._slow_queries.clear()
+
+    @contextmanager
+    def connection(self):
+        """Check out a pooled connection for the duration of the block.
+
+        Nested uses on the same thread share the outer connection.
+        """
+        if self._pid != os.getpid():
+            self._after_fork()
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        self._ensure_schema()
+        conn = self._acquire()
+        self._local.conn = conn
         try:
-            cursor.execute('ALTER TABLE visits ADD COLUMN day_of_week TEXT')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Run a block on one pooled connection inside a single transaction.
+
+        Commits when the block exits cleanly and rolls back on error. Nested
+        transactions join the outermost one.
+        """
+        with self.connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
 
-        # Initialize default wRVU conversion rate if not set
-        cursor.execute('SELECT value FROM settings WHERE key = ?', ('wrvu_conversion_rate',))
-        if not cursor.fetchone():
-            cursor.execute('INSERT INTO settings (key, value) VALUES (?, ?)',
-                         ('wrvu_conversion_rate', '36.00'))
+    def close(self):
+        """Stop the writer thread and close all idle pooled connections"""
+        self._stop_writer()
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.execute('PRAGMA optimize')
+            conn.close()
+            with self._pool_lock:
+                self._pool_created -= 1
+
+    def _ensure_schema(self):
+        """Run init_db once, before the first connection is handed out"""
+        if self._schema_ready:
+            return
+
+        with self._schema_lock:
+            # init_db's own connections come back through here on this thread
+            if self._schema_ready or self._schema_migrating:
+                return
+            self._schema_migrating = True
+            try:
+                self.init_db()
+                self._schema_ready = True
+            finally:
+                self._schema_migrating = False
 
-        conn.commit()
-        conn.close()
+    def init_db(self):
+        """Bring the schema up to date, skipping all DDL when it already is"""
+        with self.connection() as conn:
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+                return
+
+        with self.transaction() as conn:
+            # Re-read under the write lock in case another process migrated first
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {number}')
+
+    # Data versions
+    def _bump_version(self, conn, name: str):
+        """Increment a data version inside the caller's transaction"""
+        conn.execute(f'''
+            INSERT INTO data_versions (name, version, updated_at) VALUES (?, 1, {_UTC_NOW_SQL})
+            ON CONFLICT (name) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at
+        ''', (name,))
+
+    def get_data_version(self, name: str) -> int:
+        """Current value of a data version counter"""
+        with self.connection() as conn:
+            row = conn.execute('SELECT version FROM data_versions WHERE name = ?', (name,)).fetchone()
+
+        return row['version'] if row else 0
+
+    def get_data_versions(self, names: Iterable[str]) -> Dict[str, Tuple[int, Optional[str]]]:
+        """(version, updated_at) for each named data version, in a single query.
+
+        updated_at is an ISO 8601 UTC timestamp; unknown names map to (0, None).
+        """
+        names = list(names)
+        placeholders = ', '.join('?' * len(names))
+        with self.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT name, version, updated_at FROM data_versions WHERE name IN ({placeholders})
+            ''', names).fetchall()
+
+        found = {row['name']: (row['version'], row['updated_at']) for row in rows}
+        versions = {name: found.get(name, (0, None)) for name in names}
+
+        # Callers put these versions in ETags, so config read after this must
+        # be at least as new as the 'config' version they were given
+        cache = self._config_cache
+        if 'config' in versions and cache is not None and cache['version'] != versions['config'][0]:
+            self._config_cache = None
+
+        return versions
+
+    # Configuration cache
+    def _config(self) -> Dict:
+        """Cached settings and custom field definitions.
+
+        Writes through this object drop the cache immediately; changes from
+        other processes are noticed through the persisted 'config' version,
+        which is checked at most every CONFIG_CHECK_INTERVAL seconds, and
+        whenever get_data_versions returns a 'config' version it doesn't match.
+        """
+        now = time.monotonic()
+        cache = self._config_cache
+        if cache is not None and now - cache['checked_at'] < CONFIG_CHECK_INTERVAL:
+            return cache
+
+        version = self.get_data_version('config')
+        if cache is None or cache['version'] != version:
+            with self.connection() as conn:
+                settings = {row['key']: row['value']
+                            for row in conn.execute('SELECT key, value FROM settings')}
+
+                custom_fields = []
+                for row in conn.execute('SELECT * FROM custom_fields ORDER BY id').fetchall():
+                    field = dict(row)
+                    field['options'] = json.loads(field['options']) if field['options'] else None
+                    custom_fields.append(field)
+
+            cache = {'version': version, 'settings': settings, 'custom_fields': custom_fields}
+
+        cache['checked_at'] = now
+        self._config_cache = cache
+        return cache
+
+    # Write queue
+    def _write(self, work, *versions):
+        """Run work(conn) in a write transaction and return its result.
+
+        The named data versions are bumped with the change. With the write
+        queue enabled the work is handed to the writer thread, which commits
+        it together with any other writes waiting at the time; otherwise, or
+        when this thread is already in a transaction, it runs right here.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if not self.write_queue or (conn is not None and conn.in_transaction):
+            with self.transaction() as conn:
+                result = work(conn)
+                for name in versions:
+                    self._bump_version(conn, name)
+                return result
+
+        future = Future()
+        self._writer_queue().put((work, versions, future))
+        try:
+            return future.result(timeout=WRITE_TIMEOUT)
+        except FutureTimeoutError:
+            # Only give up on a write that can no longer run, so a caller
+            # never sees a failure for a write that commits later
+            if future.cancel():
+                raise
+            return future.result()
+
+    def _writer_queue(self) -> queue.Queue:
+        """The writer thread's job queue, starting the thread on first use"""
+        if self._pid != os.getpid():
+            self._after_fork()
+
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer_jobs = queue.Queue()
+                self._writer = threading.Thread(target=self._writer_loop,
+                                                args=(self._writer_jobs,),
+                                                name='sqlite-writer', daemon=True)
+                self._writer.start()
+            return self._writer_jobs
+
+    def _writer_loop(self, jobs: queue.Queue):
+        """Commit queued writes in groups until a None job arrives.
+
+        If the thread dies (e.g. the database can't be opened), the writes
+        still queued fail with the error instead of waiting out their
+        timeout; the next write starts a new writer.
+        """
+        try:
+            self._ensure_schema()
+            conn = self._connect()
+        except BaseException as e:
+            self._fail_queued_writes(jobs, e)
+            raise
+
+        # Writes nested inside a job join its transaction on this connection
+        self._local.conn = conn
+        batch = []
+        try:
+            while True:
+                batch = [jobs.get()]
+                while len(batch) < self.write_batch_size:
+                    try:
+                        batch.append(jobs.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = None in batch
+                # Writes whose caller timed out and cancelled them are skipped
+                batch = [job for job in batch
+                         if job is not None and job[2].set_running_or_notify_cancel()]
+                if batch:
+                    self._commit_batch(conn, batch)
+                if stop:
+                    return
+        except BaseException as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            self._fail_queued_writes(jobs, e)
+            raise
+        finally:
+            self._local.conn = None
+            conn.close()
 
-    # Visit operations
-    def create_visit(self, visit_data: Dict[str, Any]) -> int:
-        """Create a new visit record"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def _fail_queued_writes(self, jobs: queue.Queue, error: BaseException):
+        """Fail every write still waiting in a dead writer's queue"""
+        with self._writer_lock:
+            if self._writer is threading.current_thread():
+                self._writer = None
+        while True:
+            try:
+                job = jobs.get_nowait()
+            except queue.Empty:
+                return
+            if job is not None and job[2].set_running_or_notify_cancel():
+                job[2].set_exception(error)
+
+    def _commit_batch(self, conn, batch: List[Tuple]):
+        """Run a group of writes in one transaction, each in its own savepoint.
+
+        A failing write is rolled back to its savepoint and its caller gets
+        the exception; the others still commit. Callers are only answered
+        once the group has committed.
+        """
+        outcomes = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for work, versions, future in batch:
+                conn.execute('SAVEPOINT write_job')
+                try:
+                    result = work(conn)
+                    for name in versions:
+                        self._bump_version(conn, name)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write_job')
+                    conn.execute('RELEASE write_job')
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute('RELEASE write_job')
+                    outcomes.append((future, result, None))
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def _stop_writer(self):
+        """Let the writer thread finish queued writes and exit"""
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None and writer.is_alive() and self._pid == os.getpid():
+            self._writer_jobs.put(None)
+            writer.join()
+
+    @contextmanager
+    def _config_transaction(self):
+        """Transaction for a settings/custom field change.
+
+        Bumps the 'config' version with the change and drops this process's
+        cache once it has committed.
+        """
+        with self.transaction() as conn:
+            yield conn
+            self._bump_version(conn, 'config')
+        self._config_cache = None
+
+    @contextmanager
+    def _visit_transaction(self):
+        """Transaction for a change to visits, bumping the 'visits' version with it"""
+        with self.transaction() as conn:
+            yield conn
+            self._bump_version(conn, 'visits')
 
+    # Visit operations
+    def _visit_params(self, visit_data: Dict[str, Any]) -> tuple:
+        """Build the INSERT parameters for a visit"""
         # Calculate day of week from date
         visit_date = visit_data.get('date')
         if visit_date:
@@ -145,11 +1460,11 @@ class Database:
         if start_time is None or start_time == '':
             start_time = ''
 
-        cursor.execute('''
-            INSERT INTO visits (date, start_time, end_time, active_duration,
-                              visit_type, billing_code, comments, custom_fields, day_of_week)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        custom_fields = visit_data.get('custom_fields')
+        if not isinstance(custom_fields, dict):
+            custom_fields = {}
+
+        return (
             visit_data.get('date'),
             start_time,
             visit_data.get('end_time'),
@@ -157,54 +1472,176 @@ class Database:
             visit_data.get('visit_type'),
             visit_data.get('billing_code'),
             visit_data.get('comments'),
-            json.dumps(visit_data.get('custom_fields', {})),
+            json.dumps(custom_fields),
             day_of_week
-        ))
+        )
+
+    def _priced_visit_params(self, params: tuple, schedule: FeeSchedule) -> tuple:
+        """_visit_params' result with the visit's wRVU on its date appended"""
+        billing_code = params[VISIT_INSERT_COLUMNS.index('billing_code')]
+        return params + (schedule.visit_wrvu(parse_billing_codes(billing_code), params[0]),)
 
-        visit_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return visit_id
+    def create_visit(self, visit_data: Dict[str, Any]) -> int:
+        """Create a new visit record"""
+        params = self._visit_params(visit_data)
+
+        def write(conn):
+            schedule = self._fee_schedule(conn)
+            priced = self._priced_visit_params(params, schedule)
+            cursor = conn.execute(INSERT_VISIT_SQL, priced)
+            visit_id = cursor.lastrowid
+            _write_priced_billing_codes(conn, [(visit_id, visit_data.get('billing_code'), priced[0])],
+                                        schedule)
+            _write_visit_custom_values(conn, [(visit_id, visit_data.get('custom_fields'))])
+            _apply_visit_rollups(conn, [dict(zip(VISIT_INSERT_COLUMNS, priced))], 1, schedule)
+            return visit_id
+
+        return self._write(write, 'visits')
+
+    def create_visits_bulk(self, visits: Iterable[Dict[str, Any]], start_row: int = 1,
+                           chunk_size: int = 5000) -> Tuple[int, List[str]]:
+        """Validate and insert many visits, one transaction per chunk.
+
+        Rows are numbered from start_row. Returns the number of visits
+        inserted and a list of "Row N: ..." messages for rejected rows.
+        """
+        inserted = 0
+        errors = []
+        batch = []
+
+        for row_number, visit_data in enumerate(visits, start_row):
+            # Validate required fields
+            if not visit_data.get('date') or not visit_data.get('start_time'):
+                errors.append(f"Row {row_number}: Missing required fields (date or start_time)")
+                continue
+
+            try:
+                visit_data = dict(visit_data, active_duration=int(visit_data.get('active_duration', 0)))
+                batch.append(self._visit_params(visit_data))
+            except (TypeError, ValueError) as e:
+                errors.append(f"Row {row_number}: {str(e)}")
+                continue
+
+            if len(batch) >= chunk_size:
+                inserted += self._insert_visit_batch(batch)
+                batch = []
+
+        if batch:
+            inserted += self._insert_visit_batch(batch)
+
+        return inserted, errors
+
+    def _insert_visit_batch(self, batch: List[tuple]) -> int:
+        """Insert prepared visit rows in a single transaction"""
+        billing_code_index = VISIT_INSERT_COLUMNS.index('billing_code')
+        custom_fields_index = VISIT_INSERT_COLUMNS.index('custom_fields')
+
+        def write(conn):
+            schedule = self._fee_schedule(conn)
+            priced = [self._priced_visit_params(params, schedule) for params in batch]
+            conn.executemany(INSERT_VISIT_SQL, priced)
+
+            # visits uses AUTOINCREMENT and we hold the write lock, so the
+            # batch was assigned consecutive ids ending at last_insert_rowid()
+            last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+            first_id = last_id - len(batch) + 1
+            _write_priced_billing_codes(conn, [(visit_id, params[billing_code_index], params[0])
+                                               for visit_id, params in enumerate(batch, first_id)],
+                                        schedule)
+            _write_visit_custom_values(conn, [(visit_id, json.loads(params[custom_fields_index]))
+                                              for visit_id, params in enumerate(batch, first_id)])
+
+            _apply_visit_rollups(conn, [dict(zip(VISIT_INSERT_COLUMNS, params)) for params in priced],
+                                 1, schedule)
+
+        self._write(write, 'visits')
+        return len(batch)
 
     def get_visits(self, start_date: Optional[str] = None,
                    end_date: Optional[str] = None) -> List[Dict]:
         """Get visits within date range"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        if start_date and end_date:
-            cursor.execute('''
-                SELECT * FROM visits
-                WHERE date BETWEEN ? AND ?
-                ORDER BY date DESC, start_time DESC
-            ''', (start_date, end_date))
-        elif start_date:
-            cursor.execute('''
-                SELECT * FROM visits
-                WHERE date >= ?
-                ORDER BY date DESC, start_time DESC
-            ''', (start_date,))
-        else:
-            cursor.execute('SELECT * FROM visits ORDER BY date DESC, start_time DESC')
+        with self.connection() as conn:
+            if start_date and end_date:
+                cursor = conn.execute('''
+                    SELECT * FROM visits
+                    WHERE date BETWEEN ? AND ?
+                    ORDER BY date DESC, start_time DESC
+                ''', (start_date, end_date))
+            elif start_date:
+                cursor = conn.execute('''
+                    SELECT * FROM visits
+                    WHERE date >= ?
+                    ORDER BY date DESC, start_time DESC
+                ''', (start_date,))
+            else:
+                cursor = conn.execute('SELECT * FROM visits ORDER BY date DESC, start_time DESC')
+
+            visits = []
+            for row in cursor.fetchall():
+                visit = dict(row)
+                visit['custom_fields'] = _load_custom_fields(visit['custom_fields'])
+                visits.append(visit)
 
-        visits = []
-        for row in cursor.fetchall():
-            visit = dict(row)
-            visit['custom_fields'] = json.loads(visit['custom_fields']) if visit['custom_fields'] else {}
-            visits.append(visit)
-
-        conn.close()
         return visits
 
+    def iter_visits(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                    visit_type: Optional[str] = None, billing_code: Optional[str] = None,
+                    after: Optional[Tuple[str, str, int]] = None,
+                    batch_size: int = 500) -> Iterator[Dict]:
+        """Yield visits newest first, batch_size rows at a time.
+
+        Pages are fetched by keyset pagination on (date, start_time, id), so
+        memory stays bounded however many visits match. after is the key of
+        the last visit already seen, e.g. from a previous page's cursor.
+        """
+        conditions = []
+        params = []
+
+        if start_date:
+            conditions.append('date >= ?')
+            params.append(start_date)
+        if end_date:
+            conditions.append('date <= ?')
+            params.append(end_date)
+        if visit_type:
+            conditions.append('visit_type = ?')
+            params.append(visit_type)
+        if billing_code:
+            conditions.append('id IN (SELECT visit_id FROM visit_billing_codes WHERE code = ?)')
+            params.append(billing_code)
+
+        while True:
+            page_conditions = list(conditions)
+            page_params = list(params)
+            if after:
+                # The plain date bound lets SQLite start the index scan at the key
+                page_conditions.append('date <= ? AND (date, start_time, id) < (?, ?, ?)')
+                page_params += [after[0], after[0], after[1], after[2]]
+
+            where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ''
+            with self.connection() as conn:
+                rows = conn.execute(f'''
+                    SELECT * FROM visits
+                    {where}
+                    ORDER BY date DESC, start_time DESC, id DESC
+                    LIMIT ?
+                ''', page_params + [batch_size]).fetchall()
+
+            for row in rows:
+                visit = dict(row)
+                visit['custom_fields'] = _load_custom_fields(visit['custom_fields'])
+                yield visit
+
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1]['date'], rows[-1]['start_time'], rows[-1]['id'])
+
     def get_visits_by_date(self, target_date: str) -> List[Dict]:
         """Get all visits for a specific date"""
         return self.get_visits(start_date=target_date, end_date=target_date)
 
     def update_visit(self, visit_id: int, visit_data: Dict[str, Any]):
         """Update an existing visit"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
         # Build dynamic update query based on provided fields
         update_fields = []
         values = []
@@ -214,117 +1651,468 @@ class Database:
                 update_fields.append(f"{field} = ?")
                 values.append(visit_data[field])
 
+        custom_fields = visit_data.get('custom_fields')
+        if not isinstance(custom_fields, dict):
+            custom_fields = {}
         if 'custom_fields' in visit_data:
             update_fields.append("custom_fields = ?")
-            values.append(json.dumps(visit_data['custom_fields']))
+            values.append(json.dumps(custom_fields))
 
         if update_fields:
             values.append(visit_id)
             query = f"UPDATE visits SET {', '.join(update_fields)} WHERE id = ?"
-            cursor.execute(query, values)
-            conn.commit()
 
-        conn.close()
+            def write(conn):
+                schedule = self._fee_schedule(conn)
+                old_rows = conn.execute('SELECT * FROM visits WHERE id = ?', (visit_id,)).fetchall()
+                conn.execute(query, values)
+                new_rows = [dict(row) for row in conn.execute('SELECT * FROM visits WHERE id = ?', (visit_id,))]
+
+                if 'billing_code' in visit_data:
+                    conn.execute('DELETE FROM visit_billing_codes WHERE visit_id = ?', (visit_id,))
+                    _write_priced_billing_codes(conn, [(row['id'], row['billing_code'], row['date'])
+                                                       for row in new_rows], schedule)
+                    for row in new_rows:
+                        row['wrvu'] = schedule.visit_wrvu(parse_billing_codes(row['billing_code']), row['date'])
+                        conn.execute('UPDATE visits SET wrvu = ? WHERE id = ?', (row['wrvu'], row['id']))
+
+                if 'custom_fields' in visit_data:
+                    conn.execute('DELETE FROM visit_custom_values WHERE visit_id = ?', (visit_id,))
+                    _write_visit_custom_values(conn, [(row['id'], custom_fields) for row in new_rows])
+
+                _apply_visit_rollups(conn, [dict(row) for row in old_rows], -1, schedule)
+                _apply_visit_rollups(conn, new_rows, 1, schedule)
+
+            self._write(write, 'visits')
 
     def delete_visit(self, visit_id: int):
         """Delete a visit"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM visits WHERE id = ?', (visit_id,))
-        conn.commit()
-        conn.close()
+        def write(conn):
+            old_rows = conn.execute('SELECT * FROM visits WHERE id = ?', (visit_id,)).fetchall()
+            conn.execute('DELETE FROM visits WHERE id = ?', (visit_id,))
+            conn.execute('DELETE FROM visit_billing_codes WHERE visit_id = ?', (visit_id,))
+            conn.execute('DELETE FROM visit_custom_values WHERE visit_id = ?', (visit_id,))
+            _apply_visit_rollups(conn, [dict(row) for row in old_rows], -1, self._fee_schedule(conn))
+
+        self._write(write, 'visits')
+
+    # Custom field value queries
+    def get_custom_field_names(self, start_date: Optional[str] = None,
+                               end_date: Optional[str] = None) -> List[str]:
+        """Names of the custom fields recorded on visits in a date range"""
+        where, params = _date_range_clause(start_date, end_date, 'v.date')
+
+        with self.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT DISTINCT cv.field_name
+                FROM visit_custom_values cv
+                JOIN visits v ON v.id = cv.visit_id
+                {where}
+            ''', params).fetchall()
+
+        return [row[0] for row in rows]
+
+    def get_custom_field_counts(self, field_name: str, start_date: Optional[str] = None,
+                                end_date: Optional[str] = None) -> Dict[str, int]:
+        """Number of visits with each value of a custom field in a date range"""
+        where, params = _date_range_clause(start_date, end_date, 'v.date')
+        where = _add_condition(where, 'cv.field_name = ?')
+
+        with self.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT cv.value, COUNT(*)
+                FROM visit_custom_values cv
+                JOIN visits v ON v.id = cv.visit_id
+                {where}
+                GROUP BY cv.value
+            ''', params + (field_name,)).fetchall()
+
+        return {row[0]: row[1] for row in rows}
+
+    def get_visit_ids_with_custom_value(self, field_name: str, value: Any,
+                                        start_date: Optional[str] = None,
+                                        end_date: Optional[str] = None) -> List[int]:
+        """IDs of visits in a date range where a custom field has the given value"""
+        where, params = _date_range_clause(start_date, end_date, 'v.date')
+        where = _add_condition(where, 'cv.field_name = ? AND cv.value = ?')
+
+        with self.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT cv.visit_id
+                FROM visit_custom_values cv
+                JOIN visits v ON v.id = cv.visit_id
+                {where}
+                ORDER BY cv.visit_id
+            ''', params + (field_name, str(value))).fetchall()
+
+        return [row[0] for row in rows]
+
+    # Billing code aggregates
+    def get_billing_code_counts(self, start_date: Optional[str] = None,
+                                end_date: Optional[str] = None) -> Dict[str, int]:
+        """Number of times each billing code was used in a date range"""
+        where, params = _date_range_clause(start_date, end_date, 'v.date')
+
+        with self.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT bc.code, COUNT(*)
+                FROM visit_billing_codes bc
+                JOIN visits v ON v.id = bc.visit_id
+                {where}
+                GROUP BY bc.code
+            ''', params).fetchall()
+
+        return {row[0]: row[1] for row in rows}
+
+    def get_total_wrvu(self, start_date: Optional[str] = None,
+                       end_date: Optional[str] = None) -> float:
+        """Total wRVU billed in a date range, as stored on the visits"""
+        where, params = _date_range_clause(start_date, end_date, 'date')
+
+        with self.connection() as conn:
+            row = conn.execute(f'SELECT COALESCE(SUM(wrvu), 0) FROM visits {where}', params).fetchone()
+
+        return row[0]
+
+    def get_visit_ids_with_billing_code(self, code: str, start_date: Optional[str] = None,
+                                        end_date: Optional[str] = None) -> List[int]:
+        """IDs of visits in a date range that used the given billing code"""
+        where, params = _date_range_clause(start_date, end_date, 'v.date')
+        where = _add_condition(where, 'bc.code = ?')
+
+        with self.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT DISTINCT bc.visit_id
+                FROM visit_billing_codes bc
+                JOIN visits v ON v.id = bc.visit_id
+                {where}
+                ORDER BY bc.visit_id
+            ''', params + (code,)).fetchall()
+
+        return [row[0] for row in rows]
+
+    # Fee schedule
+    def _fee_schedule(self, conn) -> FeeSchedule:
+        """The stored fee schedule, cached per 'fee_schedule' data version.
+
+        The version is read on the caller's connection, so a write is always
+        priced with the schedule its own transaction sees. Schedules read
+        inside a transaction are not cached, since it may still roll back.
+        """
+        row = conn.execute("SELECT version FROM data_versions WHERE name = 'fee_schedule'").fetchone()
+        version = row[0] if row else 0
+        cache = self._fee_schedule_cache
+        if cache is not None and cache[0] == version:
+            return cache[1]
+
+        schedule = FeeSchedule.load(conn)
+        if not conn.in_transaction:
+            self._fee_schedule_cache = (version, schedule)
+        return schedule
+
+    def get_fee_schedule(self, on_date: Optional[str] = None) -> Dict[str, Dict]:
+        """Billing codes in force on a date (the latest version of each by default)"""
+        with self.connection() as conn:
+            return self._fee_schedule(conn).lookup(on_date)
+
+    def get_fee_schedule_versions(self) -> List[Dict]:
+        """Every dated version in the fee schedule, by code then effective date"""
+        with self.connection() as conn:
+            return self._fee_schedule(conn).versions()
+
+    def set_fee_schedule(self, effective_date: str, entries: Iterable[Dict]) -> int:
+        """Add or replace billing code wRVU values in force from effective_date.
+
+        entries are {'code', 'wrvu', 'description'} dicts; a missing
+        description is carried over from the code's latest version. Only the
+        visits the change re-prices are touched. Returns how many there were.
+        """
+        date.fromisoformat(effective_date)
+        rows = []
+        for entry in entries:
+            code = str(entry.get('code') or '').strip()
+            wrvu = float(entry['wrvu'])
+            if not code or wrvu < 0:
+                raise ValueError(f'Invalid fee schedule entry: {entry}')
+            rows.append((code, effective_date, wrvu, entry.get('description'), code))
+
+        def write(conn):
+            old = self._fee_schedule(conn)
+            conn.executemany('''
+                INSERT INTO fee_schedule (code, effective_date, wrvu, description)
+                VALUES (?, ?, ?, COALESCE(?, (SELECT description FROM fee_schedule WHERE code = ?
+                                              ORDER BY effective_date DESC LIMIT 1), ''))
+                ON CONFLICT (code, effective_date) DO UPDATE SET
+                    wrvu = excluded.wrvu, description = excluded.description
+            ''', rows)
+            return self._reprice_visits(conn, old, FeeSchedule.load(conn),
+                                        [(row[0], effective_date) for row in rows])
+
+        return self._write(write, 'fee_schedule', 'visits')
+
+    def delete_fee_schedule_version(self, code: str, effective_date: str) -> int:
+        """Remove one dated version of a code, re-pricing the visits it covered.
+
+        Returns the number of visits re-priced.
+        """
+        def write(conn):
+            old = self._fee_schedule(conn)
+            conn.execute('DELETE FROM fee_schedule WHERE code = ? AND effective_date = ?',
+                         (code, effective_date))
+            return self._reprice_visits(conn, old, FeeSchedule.load(conn), [(code, effective_date)])
+
+        return self._write(write, 'fee_schedule', 'visits')
+
+    def _reprice_visits(self, conn, old: FeeSchedule, new: FeeSchedule,
+                        changes: Iterable[Tuple[str, str]]) -> int:
+        """Move the visits a schedule change affects from old wRVU to new.
+
+        A (code, effective_date) change reaches from its effective date to
+        the code's next version in either schedule; only visits billed with
+        the code in that range get their stored wRVU and rollups updated.
+        """
+        visit_ids = set()
+        for code, effective_date in changes:
+            ends = [end for end in (old.next_change(code, effective_date),
+                                    new.next_change(code, effective_date)) if end]
+            if ends:
+                condition, params = 'v.date >= ? AND v.date < ?', (effective_date, min(ends))
+            else:
+                # Undated visits are priced with a code's latest version
+                condition, params = '(v.date >= ? OR v.date IS NULL)', (effective_date,)
+            visit_ids.update(row[0] for row in conn.execute(f'''
+                SELECT bc.visit_id
+                FROM visit_billing_codes bc
+                JOIN visits v ON v.id = bc.visit_id
+                WHERE bc.code = ? AND {condition}
+            ''', (code,) + params))
+
+        visit_ids = sorted(visit_ids)
+        for start in range(0, len(visit_ids), REPRICE_BATCH_SIZE):
+            chunk = visit_ids[start:start + REPRICE_BATCH_SIZE]
+            visits = [dict(row) for row in conn.execute(
+                f"SELECT * FROM visits WHERE id IN ({', '.join('?' * len(chunk))})", chunk)]
+
+            _apply_visit_rollups(conn, visits, -1, old)
+            conn.executemany('UPDATE visits SET wrvu = ? WHERE id = ?', [
+                (new.visit_wrvu(parse_billing_codes(visit['billing_code']), visit['date']), visit['id'])
+                for visit in visits])
+            conn.executemany('UPDATE visit_billing_codes SET wrvu = ? WHERE visit_id = ? AND position = ?', [
+                (new.wrvu(code, visit['date']), visit_id, position)
+                for visit in visits
+                for visit_id, position, code in _billing_code_rows(visit['id'], visit['billing_code'])])
+            _apply_visit_rollups(conn, visits, 1, new)
+
+        return len(visit_ids)
+
+    def recompute_visit_wrvu(self) -> int:
+        """Re-price every visit from the stored schedule and rebuild the rollups.
+
+        A repair tool; schedule changes already re-price what they affect.
+        Returns the number of visits whose stored wRVU changed.
+        """
+        def write(conn):
+            schedule = self._fee_schedule(conn)
+
+            code_updates = []
+            for row in conn.execute('''
+                SELECT bc.visit_id, bc.position, bc.code, bc.wrvu, v.date
+                FROM visit_billing_codes bc
+                JOIN visits v ON v.id = bc.visit_id
+            ''').fetchall():
+                wrvu = schedule.wrvu(row['code'], row['date'])
+                if abs(wrvu - row['wrvu']) > 1e-9:
+                    code_updates.append((wrvu, row['visit_id'], row['position']))
+            conn.executemany('UPDATE visit_billing_codes SET wrvu = ? WHERE visit_id = ? AND position = ?',
+                             code_updates)
+
+            changed = []
+            for row in conn.execute('SELECT id, date, billing_code, wrvu FROM visits').fetchall():
+                wrvu = schedule.visit_wrvu(parse_billing_codes(row['billing_code']), row['date'])
+                if abs(wrvu - row['wrvu']) > 1e-9:
+                    changed.append((wrvu, row['id']))
+            conn.executemany('UPDATE visits SET wrvu = ? WHERE id = ?', changed)
+
+            _rebuild_daily_rollups(conn, schedule)
+            return len(changed)
+
+        return self._write(write, 'visits')
+
+    # Daily rollup operations
+    def rebuild_daily_rollups(self):
+        """Recompute the daily rollup tables from the visits table"""
+        with self._visit_transaction() as conn:
+            _rebuild_daily_rollups(conn, self._fee_schedule(conn))
+
+    def get_rollup_date_range(self) -> Optional[Tuple[str, str]]:
+        """First and last dates that have visits, or None if there are none"""
+        with self.connection() as conn:
+            row = conn.execute('SELECT MIN(date), MAX(date) FROM daily_rollups').fetchone()
+
+        return (row[0], row[1]) if row[0] else None
+
+    # Aggregation
+    def aggregate_visits(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                         group_by: Optional[List[str]] = None) -> List[Dict]:
+        """Aggregate visits in a date range with SQL GROUP BY.
+
+        group_by takes any of AGGREGATE_DIMENSIONS ('custom_field' groups by
+        field_name and field_value). Each row holds the group values plus
+        visit_count, total_duration, avg_duration and total_wrvu; for
+        billing_code groups visit_count counts code uses and total_wrvu is
+        that code's wRVU. Date plus at most one other dimension is read from
+        the daily rollups, anything else from the visits table.
+        """
+        group_by = list(group_by or [])
+        unknown = set(group_by) - set(AGGREGATE_DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Unknown group_by: {', '.join(sorted(unknown))}")
+
+        if len([g for g in group_by if g != 'date']) <= 1:
+            query, params = _rollup_aggregate_query(start_date, end_date, group_by)
+        else:
+            query, params = _visit_aggregate_query(start_date, end_date, group_by)
+
+        with self.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        return [dict(row) for row in rows if row['visit_count']]
+
+    def get_range_statistics(self, start_date: Optional[str] = None,
+                             end_date: Optional[str] = None) -> Dict:
+        """Summary statistics for a date range from SQL aggregates"""
+        return _statistics_from_aggregates(self._statistics_aggregates(start_date, end_date))
+
+    def _statistics_aggregates(self, start_date: Optional[str],
+                               end_date: Optional[str]) -> Dict[tuple, List[Dict]]:
+        """aggregate_visits rows for each of STATISTICS_GROUPS, keyed by group"""
+        with self.connection():
+            totals = self.aggregate_visits(start_date, end_date)
+            if not totals:
+                return {tuple(group): [] for group in STATISTICS_GROUPS}
+
+            return {tuple(group): self.aggregate_visits(start_date, end_date, group) if group else totals
+                    for group in STATISTICS_GROUPS}
+
+    def get_daily_rollup_statistics(self, start_date: Optional[str] = None,
+                                    end_date: Optional[str] = None) -> Dict[str, Dict]:
+        """Per-day summary statistics for a date range, keyed by date"""
+        where, params = _date_range_clause(start_date, end_date)
+
+        with self.connection() as conn:
+            totals = conn.execute(f'''
+                SELECT date, visit_count, total_duration, total_wrvu
+                FROM daily_rollups {where}
+                ORDER BY date
+            ''', params).fetchall()
+            counts = conn.execute(f'''
+                SELECT date, dimension, name, value, visit_count, total_duration
+                FROM daily_rollup_counts {where}
+            ''', params).fetchall()
+
+        counts_by_date = defaultdict(list)
+        for row in counts:
+            counts_by_date[row[0]].append(tuple(row)[1:])
+
+        return {
+            row[0]: _rollup_statistics(row[1], row[2], row[3], counts_by_date[row[0]])
+            for row in totals
+        }
+
+    def get_daily_rollup_columns(self, start_date: Optional[str] = None,
+                                 end_date: Optional[str] = None) -> Dict[str, Any]:
+        """Per-day statistics for a date range as dense parallel arrays.
+
+        'dates', 'total_visits', 'total_duration' and 'total_wrvu' are aligned
+        lists, one entry per day with visits. Each entry of 'categories' has
+        sorted 'names' (custom fields use [field_name, value] pairs) and a
+        'counts' list per name, aligned with 'dates' and zero-filled.
+        """
+        where, params = _date_range_clause(start_date, end_date)
+
+        with self.connection() as conn:
+            totals = conn.execute(f'''
+                SELECT date, visit_count, total_duration, total_wrvu
+                FROM daily_rollups {where}
+                ORDER BY date
+            ''', params).fetchall()
+            counts = conn.execute(f'''
+                SELECT dimension, name, value, date, visit_count
+                FROM daily_rollup_counts {where}
+                ORDER BY dimension, name, value
+            ''', params).fetchall()
+
+        dates = [row[0] for row in totals]
+        day_index = {day: index for index, day in enumerate(dates)}
+
+        categories = {key: {'names': [], 'counts': []} for key in ROLLUP_CATEGORY_KEYS.values()}
+        current = None
+        for dimension, name, value, day, count in counts:
+            category = categories[ROLLUP_CATEGORY_KEYS[dimension]]
+            label = [name, value] if dimension == 'custom_field' else value
+            if (dimension, label) != current:
+                current = (dimension, label)
+                category['names'].append(label)
+                category['counts'].append([0] * len(dates))
+            category['counts'][-1][day_index[day]] = count
+
+        return {
+            'dates': dates,
+            'total_visits': [row[1] for row in totals],
+            'total_duration': [row[2] for row in totals],
+            'total_wrvu': [row[3] for row in totals],
+            'categories': categories
+        }
 
     # Custom field operations
     def create_custom_field(self, field_name: str, field_type: str,
                            options: Optional[List[str]] = None):
         """Create a new custom field configuration"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT INTO custom_fields (field_name, field_type, options)
-            VALUES (?, ?, ?)
-        ''', (field_name, field_type, json.dumps(options) if options else None))
-
-        conn.commit()
-        conn.close()
+        with self._config_transaction() as conn:
+            conn.execute('''
+                INSERT INTO custom_fields (field_name, field_type, options)
+                VALUES (?, ?, ?)
+            ''', (field_name, field_type, json.dumps(options) if options else None))
 
     def get_custom_fields(self) -> List[Dict]:
         """Get all custom field configurations"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('SELECT * FROM custom_fields ORDER BY id')
-
-        fields = []
-        for row in cursor.fetchall():
-            field = dict(row)
-            field['options'] = json.loads(field['options']) if field['options'] else None
-            fields.append(field)
-
-        conn.close()
-        return fields
+        return copy.deepcopy(self._config()['custom_fields'])
 
     def delete_custom_field(self, field_id: int):
         """Delete a custom field configuration"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM custom_fields WHERE id = ?', (field_id,))
-        conn.commit()
-        conn.close()
+        with self._config_transaction() as conn:
+            conn.execute('DELETE FROM custom_fields WHERE id = ?', (field_id,))
 
     # Work day operations
     def start_work_day(self, work_date: str):
         """Mark the start of a work day"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT OR IGNORE INTO work_days (date)
-            VALUES (?)
-        ''', (work_date,))
-
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO work_days (date)
+                VALUES (?)
+            ''', (work_date,))
 
     def end_work_day(self, work_date: str, notes: Optional[str] = None):
         """Mark the end of a work day"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            UPDATE work_days
-            SET ended_at = ?, notes = ?
-            WHERE date = ?
-        ''', (datetime.now().isoformat(), notes, work_date))
-
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            conn.execute('''
+                UPDATE work_days
+                SET ended_at = ?, notes = ?
+                WHERE date = ?
+            ''', (datetime.now().isoformat(), notes, work_date))
 
     # Settings operations
     def get_setting(self, key: str, default: Optional[str] = None) -> Optional[str]:
         """Get a setting value"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
-        row = cursor.fetchone()
-
-        conn.close()
-        return row['value'] if row else default
+        return self._config()['settings'].get(key, default)
 
     def set_setting(self, key: str, value: str):
         """Set a setting value"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT OR REPLACE INTO settings (key, value, updated_at)
-            VALUES (?, ?, ?)
-        ''', (key, value, datetime.now().isoformat()))
-
-        conn.commit()
-        conn.close()
+        with self._config_transaction() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO settings (key, value, updated_at)
+                VALUES (?, ?, ?)
+            ''', (key, value, datetime.now().isoformat()))
 
     def get_wrvu_conversion_rate(self) -> float:
         """Get the wRVU to dollar conversion rate"""
@@ -338,152 +2126,376 @@ class Database:
     # QI Project operations
     def create_qi_project(self, name: str, description: str, variables: List[Dict]) -> int:
         """Create a new QI project"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT INTO qi_projects (name, description, variables)
-            VALUES (?, ?, ?)
-        ''', (name, description, json.dumps(variables)))
-
-        project_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return project_id
+        with self.transaction() as conn:
+            cursor = conn.execute('''
+                INSERT INTO qi_projects (name, description, variables)
+                VALUES (?, ?, ?)
+            ''', (name, description, json.dumps(variables)))
+            return cursor.lastrowid
 
     def get_qi_projects(self) -> List[Dict]:
         """Get all QI projects"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('SELECT * FROM qi_projects ORDER BY updated_at DESC')
+        with self.connection() as conn:
+            rows = conn.execute('SELECT * FROM qi_projects ORDER BY updated_at DESC').fetchall()
 
         projects = []
-        for row in cursor.fetchall():
+        for row in rows:
             project = dict(row)
             project['variables'] = json.loads(project['variables'])
-
-            # Get entry count for this project
-            cursor.execute('SELECT COUNT(*) as count FROM qi_project_data WHERE project_id = ?',
-                         (project['id'],))
-            count_row = cursor.fetchone()
-            project['entry_count'] = count_row['count'] if count_row else 0
-
             projects.append(project)
 
-        conn.close()
         return projects
 
     def get_qi_project(self, project_id: int) -> Optional[Dict]:
         """Get a specific QI project"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('SELECT * FROM qi_projects WHERE id = ?', (project_id,))
-        row = cursor.fetchone()
+        with self.connection() as conn:
+            row = conn.execute('SELECT * FROM qi_projects WHERE id = ?', (project_id,)).fetchone()
 
         if row:
             project = dict(row)
             project['variables'] = json.loads(project['variables'])
-            conn.close()
             return project
 
-        conn.close()
         return None
 
     def update_qi_project(self, project_id: int, name: str, description: str, variables: List[Dict]):
         """Update a QI project"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            UPDATE qi_projects
-            SET name = ?, description = ?, variables = ?, updated_at = ?
-            WHERE id = ?
-        ''', (name, description, json.dumps(variables), datetime.now().isoformat(), project_id))
-
-        conn.commit()
-        conn.close()
+        with self.transaction() as conn:
+            conn.execute('''
+                UPDATE qi_projects
+                SET name = ?, description = ?, variables = ?, updated_at = ?
+                WHERE id = ?
+            ''', (name, description, json.dumps(variables), datetime.now().isoformat(), project_id))
 
     def delete_qi_project(self, project_id: int):
         """Delete a QI project and all its data"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        # Delete project data first
-        cursor.execute('DELETE FROM qi_project_data WHERE project_id = ?', (project_id,))
-        # Delete project
-        cursor.execute('DELETE FROM qi_projects WHERE id = ?', (project_id,))
-
-        conn.commit()
-        conn.close()
-
-    def create_qi_project_entry(self, project_id: int, data: Dict) -> int:
-        """Create a new data entry for a QI project"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT INTO qi_project_data (project_id, data)
-            VALUES (?, ?)
-        ''', (project_id, json.dumps(data)))
-
-        # Update project's updated_at timestamp
-        cursor.execute('''
-            UPDATE qi_projects
-            SET updated_at = ?
-            WHERE id = ?
-        ''', (datetime.now().isoformat(), project_id))
-
-        entry_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return entry_id
+        with self.transaction() as conn:
+            # Delete project data first
+            conn.execute('DELETE FROM qi_project_data WHERE project_id = ?', (project_id,))
+            # Delete project
+            conn.execute('DELETE FROM qi_projects WHERE id = ?', (project_id,))
+
+    def create_qi_project_entry(self, project_id: int, data: Dict) -> Dict:
+        """Create a new data entry for a QI project and return it"""
+        # Same format as the column's CURRENT_TIMESTAMP default
+        created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+        def write(conn):
+            cursor = conn.execute('''
+                INSERT INTO qi_project_data (project_id, data, created_at)
+                VALUES (?, ?, ?)
+            ''', (project_id, json.dumps(data), created_at))
+
+            # Update project's entry count and updated_at timestamp
+            conn.execute('''
+                UPDATE qi_projects
+                SET entry_count = entry_count + 1, updated_at = ?
+                WHERE id = ?
+            ''', (datetime.now().isoformat(), project_id))
+            return cursor.lastrowid
+
+        entry_id = self._write(write)
+        return {'id': entry_id, 'project_id': project_id, 'data': data, 'created_at': created_at}
 
     def get_qi_project_entries(self, project_id: int) -> List[Dict]:
         """Get all data entries for a QI project"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT * FROM qi_project_data
-            WHERE project_id = ?
-            ORDER BY created_at DESC
-        ''', (project_id,))
-
-        entries = []
-        for row in cursor.fetchall():
-            entry = dict(row)
-            entry['data'] = json.loads(entry['data'])
-            entries.append(entry)
-
-        conn.close()
-        return entries
-
-    def delete_qi_project_entry(self, entry_id: int):
-        """Delete a QI project data entry"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM qi_project_data WHERE id = ?', (entry_id,))
-        conn.commit()
-        conn.close()
-
-# Helper function to calculate wRVUs for a visit
-def calculate_wrvu(billing_codes: str) -> float:
-    """Calculate total wRVU from billing code(s)"""
+        return list(self.iter_qi_project_entries(project_id))
+
+    def iter_qi_project_entries(self, project_id: int,
+                                filters: Optional[Dict[str, List[str]]] = None,
+                                created_from: Optional[str] = None,
+                                created_to: Optional[str] = None,
+                                after: Optional[Tuple[str, int]] = None,
+                                batch_size: int = 500) -> Iterator[Dict]:
+        """Yield a project's entries newest first, batch_size rows at a time.
+
+        filters maps variable names to accepted values; an entry matches when
+        each named variable equals one of its values (or, for multi-select
+        variables, contains one). created_from/created_to bound created_at by
+        date, inclusive. Pages are fetched by keyset pagination on
+        (created_at, id); after is the key of the last entry already seen.
+        """
+        conditions = ['project_id = ?']
+        params = [project_id]
+
+        for name, values in (filters or {}).items():
+            if not values:
+                continue
+            if '"' in name:
+                raise ValueError(f'Unsupported variable name: {name}')
+            placeholders = ', '.join('?' * len(values))
+            # json_each yields the scalar itself, or each element of a list
+            conditions.append(f'''EXISTS (
+                SELECT 1 FROM json_each(qi_project_data.data, ?)
+                WHERE CAST(json_each.value AS TEXT) IN ({placeholders})
+            )''')
+            params += [f'$."{name}"'] + [str(value) for value in values]
+
+        if created_from:
+            conditions.append('created_at >= ?')
+            params.append(created_from)
+        if created_to:
+            conditions.append("created_at < date(?, '+1 day')")
+            params.append(created_to)
+
+        while True:
+            page_conditions = list(conditions)
+            page_params = list(params)
+            if after:
+                page_conditions.append('created_at <= ? AND (created_at, id) < (?, ?)')
+                page_params += [after[0], after[0], after[1]]
+
+            with self.connection() as conn:
+                rows = conn.execute(f'''
+                    SELECT * FROM qi_project_data
+                    WHERE {' AND '.join(page_conditions)}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT ?
+                ''', page_params + [batch_size]).fetchall()
+
+            for row in rows:
+                entry = dict(row)
+                entry['data'] = json.loads(entry['data'])
+                yield entry
+
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1]['created_at'], rows[-1]['id'])
+
+    def get_qi_project_aggregates(self, project_id: int) -> Tuple[List[Tuple], List[Tuple]]:
+        """Weekly entry and value counts for a project, grouped in SQL.
+
+        Returns (weekly_entries, value_counts): (week, entry_count) rows and
+        (variable_name, week, value, count) rows, where week is the Monday
+        starting the week of created_at and each element of a multi-select
+        list counts as its own value. Empty values are left out.
+        """
+        with self.connection() as conn:
+            weekly_entries = conn.execute(f'''
+                SELECT {_QI_WEEK_SQL} AS week, COUNT(*)
+                FROM qi_project_data d
+                WHERE d.project_id = ?
+                GROUP BY week
+                ORDER BY week
+            ''', (project_id,)).fetchall()
+            value_counts = conn.execute(f'''
+                SELECT field.key, {_QI_WEEK_SQL} AS week, item.value, COUNT(*)
+                FROM qi_project_data d
+                JOIN json_each(d.data) field
+                JOIN json_each(CASE WHEN field.type = 'array' THEN field.value
+                                    ELSE json_array(field.value) END) item
+                WHERE d.project_id = ? AND item.value IS NOT NULL AND item.value != ''
+                GROUP BY field.key, week, item.value
+            ''', (project_id,)).fetchall()
+
+        return [tuple(row) for row in weekly_entries], [tuple(row) for row in value_counts]
+
+    def delete_qi_project_entry(self, entry_id: int, project_id: Optional[int] = None) -> Optional[Dict]:
+        """Delete a QI project data entry and return it, or None if it doesn't exist.
+
+        When project_id is given the entry must also belong to that project.
+        """
+        query = 'SELECT * FROM qi_project_data WHERE id = ?'
+        params = [entry_id]
+        if project_id is not None:
+            query += ' AND project_id = ?'
+            params.append(project_id)
+
+        def write(conn):
+            row = conn.execute(query, params).fetchone()
+            if row is None:
+                return None
+
+            conn.execute('DELETE FROM qi_project_data WHERE id = ?', (entry_id,))
+            conn.execute('''
+                UPDATE qi_projects
+                SET entry_count = entry_count - 1, updated_at = ?
+                WHERE id = ?
+            ''', (datetime.now().isoformat(), row['project_id']))
+            return row
+
+        row = self._write(write)
+        if row is None:
+            return None
+
+        entry = dict(row)
+        entry['data'] = json.loads(entry['data'])
+        return entry
+
+    # Import job operations
+    def create_import_job(self, job_id: str, filename: str):
+        """Record a newly queued import job"""
+        with self.transaction() as conn:
+            conn.execute('''
+                INSERT INTO import_jobs (id, filename, status)
+                VALUES (?, ?, ?)
+            ''', (job_id, filename, 'queued'))
+
+    def update_import_job(self, job_id: str, **fields):
+        """Update the status/progress columns of an import job"""
+        update_fields = []
+        values = []
+
+        for field in ['status', 'total_rows', 'processed_rows', 'imported',
+                      'error_count', 'error', 'finished_at']:
+            if field in fields:
+                update_fields.append(f"{field} = ?")
+                values.append(fields[field])
+
+        if 'errors' in fields:
+            update_fields.append("errors = ?")
+            values.append(json.dumps(fields['errors']))
+
+        if update_fields:
+            values.append(job_id)
+            query = f"UPDATE import_jobs SET {', '.join(update_fields)} WHERE id = ?"
+            with self.transaction() as conn:
+                conn.execute(query, values)
+
+    def get_import_job(self, job_id: str) -> Optional[Dict]:
+        """Get an import job's status and progress"""
+        with self.connection() as conn:
+            row = conn.execute('SELECT * FROM import_jobs WHERE id = ?', (job_id,)).fetchone()
+
+        if row:
+            job = dict(row)
+            job['errors'] = json.loads(job['errors']) if job['errors'] else []
+            return job
+
+        return None
+
+class DatabaseRouter:
+    """Routes to per-provider SQLite shard files, each a Database with its own pool.
+
+    The default database holds visits recorded without a provider; each
+    named shard lives at <shard_dir>/<name>.db. Shards are only created
+    through create_shard, never by routing a request, so a stray provider
+    name can't leave a database file behind. Shards are independent files,
+    so one provider's import or export only contends with that provider's
+    own writes.
+    """
+
+    def __init__(self, default: Database, shard_dir: str, **database_options):
+        self.default = default
+        self.shard_dir = shard_dir
+        self.database_options = database_options
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def _shard_path(self, name: str) -> str:
+        if not SHARD_NAME_PATTERN.match(name):
+            raise ValueError(f'Invalid shard name: {name}')
+        return os.path.join(self.shard_dir, f'{name}.db')
+
+    def shard(self, name: Optional[str] = None) -> Database:
+        """The Database for an existing provider shard, or the default one for no name.
+
+        Raises ValueError for a malformed name and LookupError for a shard
+        that doesn't exist.
+        """
+        if not name:
+            return self.default
+        path = self._shard_path(name)
+
+        with self._lock:
+            database = self._shards.get(name)
+            if database is None:
+                if not os.path.isfile(path):
+                    raise LookupError(f'Unknown provider: {name}')
+                database = Database(path, **self.database_options)
+                self._shards[name] = database
+            return database
+
+    def create_shard(self, name: str) -> Database:
+        """Create a provider shard with an up-to-date schema (or return the existing one)"""
+        path = self._shard_path(name)
+
+        with self._lock:
+            database = self._shards.get(name)
+            if database is None:
+                os.makedirs(self.shard_dir, exist_ok=True)
+                database = Database(path, **self.database_options)
+                self._shards[name] = database
+        database.init_db()
+        return database
+
+    def shard_names(self) -> List[str]:
+        """Names of all shards on disk"""
+        names = set(self._shards)
+        if os.path.isdir(self.shard_dir):
+            names.update(filename[:-3] for filename in os.listdir(self.shard_dir)
+                         if filename.endswith('.db') and SHARD_NAME_PATTERN.match(filename[:-3]))
+        return sorted(names)
+
+    def databases(self, names: Optional[Iterable[str]] = None) -> List[Database]:
+        """The default database and every shard, or just the named shards"""
+        if names is not None:
+            return [self.shard(name) for name in names]
+        return [self.default] + [self.shard(name) for name in self.shard_names()]
+
+    def close(self):
+        """Close every database's pooled connections"""
+        for database in [self.default] + list(self._shards.values()):
+            database.close()
+
+    def _map(self, function, databases: List[Database]) -> list:
+        """Call function(database) for each database, querying shards in parallel"""
+        if len(databases) <= 1:
+            return [function(database) for database in databases]
+        with ThreadPoolExecutor(max_workers=min(len(databases), SHARD_QUERY_THREADS)) as executor:
+            return list(executor.map(function, databases))
+
+    # Cross-shard aggregation
+    def get_rollup_date_range(self, shards: Optional[Iterable[str]] = None) -> Optional[Tuple[str, str]]:
+        """First and last dates with visits in any of the shards, or None"""
+        ranges = [date_range for date_range in self._map(lambda database: database.get_rollup_date_range(),
+                                                         self.databases(shards))
+                  if date_range]
+        if not ranges:
+            return None
+        return min(start for start, _ in ranges), max(end for _, end in ranges)
+
+    def shard_totals(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                     shards: Optional[Iterable[str]] = None) -> List[Dict]:
+        """Visit count, duration and wRVU totals per shard ('shard' is None for the default)"""
+        names = [None] + self.shard_names() if shards is None else list(shards)
+        results = self._map(lambda database: database.aggregate_visits(start_date, end_date),
+                            [self.shard(name) for name in names])
+
+        totals = []
+        for name, rows in zip(names, results):
+            row = rows[0] if rows else {'visit_count': 0, 'total_duration': 0,
+                                        'avg_duration': 0, 'total_wrvu': 0.0}
+            totals.append(dict(row, shard=name))
+        return totals
+
+    def aggregate_visits(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                         group_by: Optional[List[str]] = None,
+                         shards: Optional[Iterable[str]] = None) -> List[Dict]:
+        """Database.aggregate_visits summed across shards (all of them by default)"""
+        return _merge_aggregate_rows(self._map(
+            lambda database: database.aggregate_visits(start_date, end_date, group_by),
+            self.databases(shards)))
+
+    def get_range_statistics(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                             shards: Optional[Iterable[str]] = None) -> Dict:
+        """Database.get_range_statistics for the visits of several shards combined"""
+        results = self._map(lambda database: database._statistics_aggregates(start_date, end_date),
+                            self.databases(shards))
+        return _statistics_from_aggregates({
+            tuple(group): _merge_aggregate_rows(result[tuple(group)] for result in results)
+            for group in STATISTICS_GROUPS
+        })
+
+
+# Helper function to split a stored billing_code into its codes
+def parse_billing_codes(billing_codes: Optional[str]) -> List[str]:
+    """Parse a billing code value (single code or JSON array) into a list"""
     if not billing_codes:
-        return 0.0
+        return []
 
     # Handle both single code (string) and multiple codes (JSON array)
     try:
-        codes = json.loads(billing_codes) if billing_codes.startswith('[') else [billing_codes]
-    except:
-        codes = [billing_codes]
-
-    total_wrvu = 0.0
-    for code in codes:
-        code = code.strip()
-        if code in WRVU_LOOKUP:
-            total_wrvu += WRVU_LOOKUP[code]['wrvu']
-
-    return total_wrvu
+        return json.loads(billing_codes) if billing_codes.startswith('[') else [billing_codes]
+    except ValueError:
+        return [billing_codes]
@@ -0,0 +1,151 @@
+import csv
+import io
+import json
+import tempfile
+from typing import Dict, Iterator, List, Optional
+
+# Visit columns in the export, using import-compatible names
+VISIT_COLUMNS = ['date', 'start_time', 'end_time', 'active_duration',
+                 'visit_type', 'billing_code', 'comments']
+
+# Rows written per chunk of a streamed CSV/NDJSON response
+STREAM_CHUNK_ROWS = 500
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def export_columns(db, start_date: Optional[str], end_date: Optional[str]) -> List[str]:
+    """Header for an export: visit columns, then every custom field used in the range.
+
+    Configured custom fields come first in their settings order, followed by
+    any other fields (e.g. from imports) alphabetically.
+    """
+    used = set(db.get_custom_field_names(start_date, end_date))
+    configured = [field['field_name'] for field in db.get_custom_fields()
+                  if field['field_name'] in used]
+    others = sorted(used - set(configured))
+    return VISIT_COLUMNS + [name for name in configured + others if name not in VISIT_COLUMNS]
+
+
+def _iter_rows(db, start_date: Optional[str], end_date: Optional[str], columns: List[str]):
+    """Visits in the range as lists of cell values in header order"""
+    custom_columns = columns[len(VISIT_COLUMNS):]
+    for visit in db.iter_visits(start_date=start_date, end_date=end_date):
+        custom_fields = visit['custom_fields']
+        yield ([visit[name] for name in VISIT_COLUMNS] +
+               [custom_fields.get(name) for name in custom_columns])
+
+
+def _statistics_rows(db, start_date: Optional[str], end_date: Optional[str]) -> List[list]:
+    """Rows of the Statistics sheet"""
+    stats = db.get_range_statistics(start_date, end_date)
+
+    stats_data = [
+        ['Metric', 'Value'],
+        ['Total Visits', stats['total_visits']],
+        ['Average Duration (min)', stats['avg_duration'] / 60],
+        ['Total Duration (min)', stats['total_duration'] / 60],
+        ['', ''],
+        ['Visit Types', 'Count']
+    ]
+
+    for vtype, count in stats['visit_types'].items():
+        stats_data.append([vtype, count])
+
+    stats_data.append(['', ''])
+    stats_data.append(['Billing Codes', 'Count'])
+
+    for code, count in stats['billing_codes'].items():
+        stats_data.append([code, count])
+
+    return stats_data
+
+
+def write_xlsx(db, start_date: Optional[str], end_date: Optional[str]):
+    """Write the Visits and Statistics sheets to a temporary file and return it.
+
+    Uses openpyxl's write-only mode, so rows go straight from the database
+    cursor to disk instead of being held in memory.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+
+    visits_sheet = workbook.create_sheet('Visits')
+    columns = export_columns(db, start_date, end_date)
+    visits_sheet.append(columns)
+    for row in _iter_rows(db, start_date, end_date, columns):
+        visits_sheet.append(row)
+
+    stats_sheet = workbook.create_sheet('Statistics')
+    for row in _statistics_rows(db, start_date, end_date):
+        stats_sheet.append(row)
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+
+def iter_csv(db, start_date: Optional[str], end_date: Optional[str]) -> Iterator[str]:
+    """Stream the Visits sheet as CSV text chunks"""
+    columns = export_columns(db, start_date, end_date)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+
+    for count, row in enumerate(_iter_rows(db, start_date, end_date, columns), 1):
+        writer.writerow(row)
+        if count % STREAM_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def iter_ndjson(db, start_date: Optional[str], end_date: Optional[str]) -> Iterator[str]:
+    """Stream visits as newline-delimited JSON objects with the export columns as keys"""
+    columns = export_columns(db, start_date, end_date)
+    lines = []
+
+    for row in _iter_rows(db, start_date, end_date, columns):
+        lines.append(json.dumps(dict(zip(columns, row))))
+        if len(lines) >= STREAM_CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def qi_export_columns(project: Dict) -> List[str]:
+    """Header of a QI project export: entry ID, creation time, then each variable"""
+    return ['Entry ID', 'Created At'] + [variable['name'] for variable in project['variables']]
+
+
+def iter_qi_csv(db, project: Dict) -> Iterator[str]:
+    """Stream a QI project's entries as CSV text chunks, newest first.
+
+    List values (multi-select variables) are joined with "; ".
+    """
+    names = [variable['name'] for variable in project['variables']]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(qi_export_columns(project))
+
+    for count, entry in enumerate(db.iter_qi_project_entries(project['id']), 1):
+        row = [entry['id'], entry['created_at']]
+        for name in names:
+            value = entry['data'].get(name, '')
+            if isinstance(value, list):
+                value = '; '.join(str(v) for v in value)
+            row.append(value)
+        writer.writerow(row)
+
+        if count % STREAM_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
@@ -0,0 +1,40 @@
+"""Gunicorn settings for serving Clinic Tracker in production.
+
+Run with `gunicorn -c gunicorn.conf.py`. Every setting can be overridden
+through the environment variables below; see DOCKER_README.md for guidance
+on worker counts with the SQLite backend.
+"""
+import os
+
+wsgi_app = 'app:app'
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+
+# SQLite allows one writer at a time, so a few processes with several
+# threads each serve best; more processes only add write contention
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Import the app once in the master so workers fork with it already loaded.
+# Importing opens no database connections, and each worker's Database starts
+# its own pool after the fork. With preload on, SIGHUP restarts the workers
+# gracefully but keeps the loaded code; set GUNICORN_PRELOAD=0 to pick up
+# new code on SIGHUP
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Seconds a worker may stay silent before it is killed and replaced, and
+# seconds in-flight requests get to finish on reload or shutdown
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycling workers would also kill background import jobs running in them,
+# so it is off unless asked for
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
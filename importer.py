@@ -0,0 +1,172 @@
+import os
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List
+
+import pandas as pd
+
+# Rows parsed, validated and written per step of an import job
+CHUNK_SIZE = 5000
+
+# Columns that map onto visit fields; any other column is a custom field
+VISIT_COLUMNS = ['date', 'start_time', 'end_time', 'active_duration',
+                 'visit_type', 'billing_code', 'comments', 'day_of_week']
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
+
+def is_supported_file(filename: str) -> bool:
+    """Check whether an upload has an importable extension"""
+    return filename.endswith(SUPPORTED_EXTENSIONS)
+
+
+def start_import_job(db, path: str, filename: str) -> str:
+    """Queue an import of the file saved at path and return its job ID.
+
+    The import runs on a background thread that owns (and finally deletes)
+    the file; progress is recorded in the import_jobs table.
+    """
+    job_id = uuid.uuid4().hex
+    db.create_import_job(job_id, filename)
+
+    thread = threading.Thread(target=run_import_job,
+                              args=(db, job_id, path, filename),
+                              name=f'import-{job_id[:8]}',
+                              daemon=True)
+    thread.start()
+    return job_id
+
+
+def run_import_job(db, job_id: str, path: str, filename: str):
+    """Parse, validate and write an uploaded file chunk by chunk"""
+    processed = 0
+    imported = 0
+    errors = []
+
+    try:
+        db.update_import_job(job_id, status='running',
+                             total_rows=_estimate_row_count(path, filename))
+
+        for chunk in _read_chunks(path, filename):
+            visits = frame_to_visits(chunk)
+            chunk_imported, chunk_errors = db.create_visits_bulk(visits, start_row=processed + 1)
+
+            processed += len(chunk)
+            imported += chunk_imported
+            errors.extend(chunk_errors)
+
+            db.update_import_job(job_id, processed_rows=processed, imported=imported,
+                                 error_count=len(errors))
+
+        db.update_import_job(job_id, status='completed', total_rows=processed,
+                             errors=errors, finished_at=datetime.now().isoformat())
+
+    except Exception as e:
+        db.update_import_job(job_id, status='failed', error=str(e), errors=errors,
+                             finished_at=datetime.now().isoformat())
+
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _estimate_row_count(path: str, filename: str):
+    """Cheap row count used for progress; exact for CSVs without quoted newlines"""
+    if not filename.endswith('.csv'):
+        return None
+
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+
+    if last != b'\n':
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def _read_chunks(path: str, filename: str):
+    """Yield the file as DataFrames of at most CHUNK_SIZE rows"""
+    if filename.endswith('.csv'):
+        # Read everything as text so no per-cell str() is needed later
+        with pd.read_csv(path, dtype=str, chunksize=CHUNK_SIZE) as reader:
+            for chunk in reader:
+                yield chunk
+    else:
+        # Excel can't be streamed, but validation and writes still go in chunks
+        df = pd.read_excel(path)
+        for start in range(0, len(df), CHUNK_SIZE):
+            yield df.iloc[start:start + CHUNK_SIZE]
+
+
+def _text_column(df: pd.DataFrame, column: str) -> List[str]:
+    """A column as strings, with missing values as ''"""
+    if column not in df.columns:
+        return [''] * len(df)
+
+    values = df[column]
+    return values.astype(str).where(values.notna(), '').tolist()
+
+
+def _duration_column(df: pd.DataFrame) -> List:
+    """active_duration as numbers, keeping unparseable values for validation to reject"""
+    if 'active_duration' not in df.columns:
+        return [0] * len(df)
+
+    raw = df['active_duration']
+    numeric = pd.to_numeric(raw, errors='coerce')
+    return numeric.astype(object).where(numeric.notna(), raw).tolist()
+
+
+def _custom_field_column(df: pd.DataFrame) -> List[Dict[str, str]]:
+    """Custom field dicts built from every non-visit column"""
+    extra_columns = [col for col in df.columns if col not in VISIT_COLUMNS]
+    if not extra_columns:
+        return [{} for _ in range(len(df))]
+
+    extra = df[extra_columns]
+    extra = extra.astype(str).where(extra.notna(), None)
+    names = [str(col) for col in extra_columns]
+
+    return [
+        {name: value for name, value in zip(names, values) if value is not None}
+        for values in extra.itertuples(index=False, name=None)
+    ]
+
+
+def frame_to_visits(df: pd.DataFrame) -> List[Dict]:
+    """Convert a parsed chunk into visit dicts for Database.create_visits_bulk.
+
+    Each column is converted in a single vectorized step; the only per-row
+    work is zipping the prepared columns together.
+    """
+    columns = zip(
+        _text_column(df, 'date'),
+        _text_column(df, 'start_time'),
+        _text_column(df, 'end_time'),
+        _duration_column(df),
+        _text_column(df, 'visit_type'),
+        _text_column(df, 'billing_code'),
+        _text_column(df, 'comments'),
+        _custom_field_column(df),
+    )
+
+    return [
+        {
+            'date': visit_date,
+            'start_time': start_time,
+            'end_time': end_time,
+            'active_duration': active_duration,
+            'visit_type': visit_type,
+            'billing_code': billing_code,
+            'comments': comments,
+            'custom_fields': custom_fields
+        }
+        for (visit_date, start_time, end_time, active_duration,
+             visit_type, billing_code, comments, custom_fields) in columns
+    ]
@@ -0,0 +1,229 @@
+import functools
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+PREFIX = 'clinic_tracker_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Route label for requests that matched no route, so stray URLs don't add series
+UNMATCHED_ROUTE = '<unmatched>'
+
+# WSGI environ key the app stores the matched route rule under
+ROUTE_ENVIRON_KEY = 'clinic_tracker.route'
+
+_TABLE_PATTERN = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+(\w+)', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_name(sql: str) -> str:
+    """Short label for a statement: its verb and first table, e.g. 'SELECT visits'"""
+    words = sql.split(None, 1)
+    if not words:
+        return 'OTHER'
+    table = _TABLE_PATTERN.search(sql)
+    return f'{words[0].upper()} {table.group(1)}' if table else words[0].upper()
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Counter:
+    """Monotonic count per label set"""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}'
+                for labels, value in values]
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((labels, (list(counts), total))
+                            for labels, (counts, total) in self._values.items())
+
+        lines = []
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests by route and status',
+                   ['method', 'route', 'status'])
+REQUEST_DURATION = Histogram('http_request_duration_seconds',
+                             'Time from receiving a request to sending the last byte',
+                             ['method', 'route'], LATENCY_BUCKETS)
+RESPONSE_SIZE = Histogram('http_response_size_bytes', 'Response body size',
+                          ['method', 'route'], SIZE_BUCKETS)
+REQUEST_QUERIES = Histogram('http_request_sql_queries', 'SQL statements run per request',
+                            ['method', 'route'], QUERY_COUNT_BUCKETS)
+REQUEST_SQL_TIME = Histogram('http_request_sql_seconds', 'Time per request spent in SQL statements',
+                             ['method', 'route'], LATENCY_BUCKETS)
+QUERY_DURATION = Histogram('sql_query_duration_seconds',
+                           'SQL statement time, including fetching its rows',
+                           ['database', 'statement'], QUERY_BUCKETS)
+QUERY_ROWS = Counter('sql_query_rows_total', 'Rows returned or written by SQL statements',
+                     ['database', 'statement'])
+
+REGISTRY = [REQUESTS, REQUEST_DURATION, RESPONSE_SIZE, REQUEST_QUERIES, REQUEST_SQL_TIME,
+            QUERY_DURATION, QUERY_ROWS]
+
+# Statement count and SQL time of the request being served on this thread
+_request_sql = threading.local()
+
+
+def render() -> str:
+    """Every metric in Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def database_label(db_path: str) -> str:
+    """Database label: the file name without its extension (a shard's provider name)"""
+    name = db_path.replace('\\', '/').rsplit('/', 1)[-1]
+    return name[:-3] if name.endswith('.db') else name
+
+
+def record_query(database, sql: str, parameters, seconds: float, rows: int):
+    """Database query listener: per-statement metrics plus the current request's totals"""
+    labels = (database_label(database.db_path), statement_name(sql))
+    QUERY_DURATION.observe(labels, seconds)
+    QUERY_ROWS.inc(labels, rows)
+
+    totals = getattr(_request_sql, 'totals', None)
+    if totals is not None:
+        totals[0] += 1
+        totals[1] += seconds
+
+
+class RequestMetrics:
+    """WSGI middleware timing each request until its last body byte is sent.
+
+    Streamed responses (exports) are measured to the end of the stream, and
+    SQL run while producing them counts towards the request.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        _request_sql.totals = [0, 0.0]
+        status = []
+
+        def record_status(status_line, headers, exc_info=None):
+            status[:] = [status_line.split(' ', 1)[0]]
+            return start_response(status_line, headers, exc_info)
+
+        try:
+            body = self.wsgi_app(environ, record_status)
+        except Exception:
+            self._finish(environ, start, '500', 0)
+            raise
+        return _MeasuredBody(self, environ, start, status, body)
+
+    def _finish(self, environ, start: float, status: Optional[str], size: int):
+        totals = getattr(_request_sql, 'totals', None) or [0, 0.0]
+        _request_sql.totals = None
+
+        labels = (environ.get('REQUEST_METHOD', ''), environ.get(ROUTE_ENVIRON_KEY, UNMATCHED_ROUTE))
+        REQUESTS.inc(labels + (status or '500',))
+        REQUEST_DURATION.observe(labels, time.perf_counter() - start)
+        RESPONSE_SIZE.observe(labels, size)
+        REQUEST_QUERIES.observe(labels, totals[0])
+        REQUEST_SQL_TIME.observe(labels, totals[1])
+
+
+class _MeasuredBody:
+    """Response iterable that counts bytes and records metrics when closed"""
+
+    def __init__(self, middleware: RequestMetrics, environ: Dict, start: float,
+                 status: List[str], body):
+        self.middleware = middleware
+        self.environ = environ
+        self.start = start
+        self.status = status
+        self.body = body
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.middleware._finish(self.environ, self.start,
+                                    self.status[0] if self.status else None, self.size)
@@ -0,0 +1,182 @@
+import math
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+# Maximum number of bins in a numeric variable's histogram
+HISTOGRAM_BINS = 10
+
+# Variable types whose run charts are also broken down by value
+CATEGORICAL_TYPES = ('dropdown', 'multiselect', 'boolean')
+
+# (database path, project_id) -> (updated_at, analytics)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def project_analytics(db, project: Dict) -> Dict:
+    """Analytics for a QI project, cached until its updated_at changes"""
+    key = project['updated_at']
+    # Project IDs repeat across provider shards, so key by database file too
+    cache_key = (db.db_path, project['id'])
+    with _cache_lock:
+        cached = _cache.get(cache_key)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    weekly_entries, value_counts = db.get_qi_project_aggregates(project['id'])
+    analytics = build_analytics(project['variables'], weekly_entries, value_counts)
+
+    with _cache_lock:
+        _cache[cache_key] = (key, analytics)
+    return analytics
+
+
+def _week_range(first: str, last: str) -> List[str]:
+    """Every week start from first to last inclusive, so run charts show gaps"""
+    weeks = []
+    week = date.fromisoformat(first)
+    end = date.fromisoformat(last)
+    while week <= end:
+        weeks.append(week.isoformat())
+        week += timedelta(days=7)
+    return weeks
+
+
+def _to_number(value) -> Optional[float]:
+    """A recorded value as a finite number, or None if it isn't one"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _weighted_median(counts: List[Tuple[float, int]], total: int) -> float:
+    """Median of (value, count) pairs sorted by value"""
+    position = 0
+    lower = None
+    for value, count in counts:
+        position += count
+        if lower is None and position >= (total + 1) // 2:
+            lower = value
+        if position >= total // 2 + 1:
+            return value if total % 2 else (lower + value) / 2
+    return lower
+
+
+def _histogram(counts: List[Tuple[float, int]]) -> Dict:
+    """Equal-width histogram of (value, count) pairs sorted by value"""
+    low, high = counts[0][0], counts[-1][0]
+    bins = min(HISTOGRAM_BINS, len(counts))
+    width = (high - low) / bins if high > low else 1
+    histogram = [0] * bins
+
+    for value, count in counts:
+        histogram[min(int((value - low) / width), bins - 1)] += count
+
+    return {
+        'edges': [low + width * i for i in range(bins + 1)],
+        'counts': histogram
+    }
+
+
+def _numeric_stats(by_week: Dict[str, List[Tuple]], weeks: List[str]) -> Dict:
+    """Count, mean, median, range, histogram and weekly means of a numeric variable"""
+    totals = defaultdict(int)
+    week_counts = defaultdict(int)
+    week_sums = defaultdict(float)
+
+    for week, values in by_week.items():
+        for value, count in values:
+            number = _to_number(value)
+            if number is None:
+                continue
+            totals[number] += count
+            week_counts[week] += count
+            week_sums[week] += number * count
+
+    stats = {
+        'count': sum(totals.values()),
+        'run_chart': {
+            'count': [week_counts[week] for week in weeks],
+            'mean': [week_sums[week] / week_counts[week] if week_counts[week] else None
+                     for week in weeks]
+        }
+    }
+    if not totals:
+        return stats
+
+    counts = sorted(totals.items())
+    stats.update({
+        'mean': sum(value * count for value, count in counts) / stats['count'],
+        'median': _weighted_median(counts, stats['count']),
+        'min': counts[0][0],
+        'max': counts[-1][0],
+        'histogram': _histogram(counts)
+    })
+    return stats
+
+
+def _categorical_stats(variable_type: str, by_week: Dict[str, List[Tuple]],
+                       weeks: List[str]) -> Dict:
+    """Frequencies, most common value and weekly counts of a non-numeric variable"""
+    frequencies = defaultdict(int)
+    week_counts = defaultdict(int)
+    value_weeks = defaultdict(lambda: defaultdict(int))
+
+    for week, values in by_week.items():
+        for value, count in values:
+            value = str(value)
+            frequencies[value] += count
+            week_counts[week] += count
+            value_weeks[value][week] += count
+
+    stats = {
+        'count': sum(frequencies.values()),
+        'frequencies': dict(frequencies),
+        'run_chart': {'count': [week_counts[week] for week in weeks]}
+    }
+    if variable_type in CATEGORICAL_TYPES:
+        stats['run_chart']['by_value'] = {
+            value: [counts[week] for week in weeks] for value, counts in value_weeks.items()
+        }
+    if frequencies:
+        most_common = max(frequencies.items(), key=lambda item: item[1])
+        stats['most_common'], stats['most_common_count'] = most_common
+    return stats
+
+
+def build_analytics(variables: List[Dict], weekly_entries: List[Tuple],
+                    value_counts: List[Tuple]) -> Dict:
+    """Summarize a project from Database.get_qi_project_aggregates rows.
+
+    Numbers get count, mean, median, min/max and a histogram; every other
+    type gets value frequencies. Each variable's run chart is a list of
+    weekly values aligned with 'weeks'.
+    """
+    weeks = _week_range(weekly_entries[0][0], weekly_entries[-1][0]) if weekly_entries else []
+
+    values = defaultdict(lambda: defaultdict(list))
+    for name, week, value, count in value_counts:
+        values[name][week].append((value, count))
+
+    entries_by_week = dict(weekly_entries)
+    analytics = {
+        'total_entries': sum(entries_by_week.values()),
+        'weeks': weeks,
+        'entries_per_week': [entries_by_week.get(week, 0) for week in weeks],
+        'variables': {}
+    }
+
+    for variable in variables:
+        by_week = values.get(variable['name'], {})
+        if variable['type'] == 'number':
+            stats = _numeric_stats(by_week, weeks)
+        else:
+            stats = _categorical_stats(variable['type'], by_week, weeks)
+        stats['type'] = variable['type']
+        analytics['variables'][variable['name']] = stats
+
+    return analytics